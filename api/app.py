@@ -1,5 +1,7 @@
 import asyncio
+import hashlib
 import hmac
+import json
 import queue
 import shutil
 import threading
@@ -10,32 +12,52 @@ from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 from enum import Enum
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
-from fastapi import FastAPI, Depends, File, Form, Request, Security, UploadFile, WebSocket
+from fastapi import FastAPI, Depends, File, Form, Query, Request, Security, UploadFile, WebSocket, WebSocketDisconnect
+from fastapi.concurrency import run_in_threadpool
 from fastapi.exceptions import HTTPException
-from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
+from starlette.websockets import WebSocketState
 from fastapi.security.api_key import APIKeyHeader
 from pydantic import BaseModel, Field, RootModel
 
 from api.config import settings
+from api.datasets import delete_old_datasets, get_dataset, link_dataset, link_file, register_parsed, store_upload
+from api.downloads import SelectiveGZipMiddleware, negotiate_encoding, stream_zip
+from api.events import JobEventBroker
+from api.features import MAX_PAGE_SIZE, feature_collection, find_feature_store, layer_info, parse_bbox, query_features
+from api.metrics import CONTENT_TYPE, DOWNLOAD_BYTES, JOB_DURATION, REGISTRY, register_gauge
+from api.scheduler import JobPriority, JobScheduler, estimate_job_cost
+from api.tiles import TILE_MEDIA_TYPE, TileCache
 from api.paths import JOBS_DIR
-from pipeline.run import run_pipeline, setup_logging
+from pipeline.cancellation import CancelToken, PipelineCancelled, PipelineTimeout
+from pipeline.checkpoints import CHECKPOINTS_DIR
+from pipeline.profiling import PROFILE_FILE, current_rss
+from pipeline.run import DISTANCE_TIME_BUDGET, run_pipeline, setup_logging
+from pipeline.steps.export_results import FEATURE_STORE, SIDECAR_ENCODINGS
+from pipeline.steps.summarize_results import summary_to_arrow
+from pipeline.steps.vector_tiles import MAX_ZOOM, TILES_DIR, render_tile, tile_path
+from pipeline.tracing import SPAN_KIND_SERVER, TRACES_FILE, Span, Tracer, format_traceparent, new_span_id, new_trace_id
 
 # ----------------------------------------------------------------------------------------------------------------------
 # security
 # ----------------------------------------------------------------------------------------------------------------------
 
 API_KEY = settings.api_key
+API_KEYS = [API_KEY, *settings.api_keys]
 
 api_key_header = APIKeyHeader(name="x-api-key", auto_error=False)
 
 
 async def verify_api_key(api_key: str = Security(api_key_header)):
-    if not api_key or not hmac.compare_digest(api_key, API_KEY):
+    if not api_key or not any(hmac.compare_digest(api_key, key) for key in API_KEYS):
         raise HTTPException(status_code=403, detail="Unauthorized: Invalid API key")
 
+
+def api_key_tenant(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
 # ----------------------------------------------------------------------------------------------------------------------
 # models
 # ----------------------------------------------------------------------------------------------------------------------
@@ -43,6 +65,44 @@ async def verify_api_key(api_key: str = Security(api_key_header)):
 class OutputFormat(str, Enum):
     geojson = "GeoJSON"
     gpkg = "GPKG"
+    parquet = "GeoParquet"
+    fgb = "FlatGeobuf"
+
+
+class OutputLayer(str, Enum):
+    od_points_a = "od_points_a"
+    od_points_b = "od_points_b"
+    od_edges = "od_edges"
+    edges_base = "edges_base"
+    edges_quality = "edges_quality"
+    routes_base = "routes_base"
+    routes_quality = "routes_quality"
+    stops_updated = "stops_updated"
+    households = "households"
+    edges = "edges"
+    stop_edges = "stop_edges"
+    household_points = "household_points"
+    stop_households = "stop_households"
+    edge_flows_base = "edge_flows_base"
+    edge_flows_quality = "edge_flows_quality"
+    stops_sweep = "stops_sweep"
+
+
+class FlowAggregation(str, Enum):
+    overall = "overall"
+    stop = "stop"
+
+
+class SummaryFormat(str, Enum):
+    json = "json"
+    arrow = "arrow"
+
+
+class DatasetOut(BaseModel):
+    dataset_id: str = Field(..., description="SHA-256 of the file content", examples=["9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"])
+    filename: str = Field(..., description="Original filename", examples=["b_klynger.gpkg"])
+    size: int = Field(..., description="File size in bytes", examples=[1048576])
+    created_at: str = Field(..., description="ISO 8601 registration time", examples=["2025-10-13T12:46:57Z"])
 
 
 class JobCreateOut(BaseModel):
@@ -53,12 +113,19 @@ class JobCreateOut(BaseModel):
 
 class JobStatusOut(BaseModel):
     job_id: str = Field(..., description="Unique job ID", examples=["550e8400-e29b-41d4-a716-446655440000"])
-    status: str = Field(..., description="Job status", examples=["running", "done", "failed"])
-    step: Optional[str] = Field(None, description="Current processing step", examples=["1/10"])
+    status: str = Field(..., description="Job status", examples=["running", "done", "failed", "cancelled"])
+    step: Optional[str] = Field(None, description="Current processing steps, concurrent steps are comma-separated", examples=["1/8", "2,3/8"])
+    progress: Optional[str] = Field(None, description="Progress within the current step", examples=["120/300"])
     created_at: Optional[str] = Field(None, description="ISO 8601 creation time", examples=["2025-10-13T12:46:57"])
     started_at: Optional[str] = Field(None, description="ISO 8601 start time", examples=["2025-10-13T12:46:57Z"])
     finished_at: Optional[str] = Field(None, description="ISO 8601 finish time", examples=["2025-10-13T12:47:58Z"])
     error: Optional[str] = Field(None, description="Error message if failed")
+    cached_from: Optional[str] = Field(None, description="Job ID whose outputs were reused for identical inputs")
+    priority: Optional[JobPriority] = Field(None, description="Scheduling priority class", examples=["normal"])
+    estimated_cost: Optional[float] = Field(None, description="Estimated job cost used for scheduling", examples=[5400.0])
+    base_job_id: Optional[str] = Field(None, description="Job this job was derived from", examples=["550e8400-e29b-41d4-a716-446655440000"])
+    trace_id: Optional[str] = Field(None, description="Trace of the job's spans in traces.jsonl of the job directory", examples=["4bf92f3577b34da6a3ce929d0e0e4736"])
+    summary: Optional[Dict[str, Any]] = Field(None, description="Per-stop key metrics and job-wide distributions, see /jobs/{job_id}/summary")
 
 
 class JobDownloadItem(BaseModel):
@@ -74,12 +141,47 @@ class JobDownloadsOut(RootModel[list[JobDownloadItem]]):
 # utilities
 # ----------------------------------------------------------------------------------------------------------------------
 
-def check_extension(upload: UploadFile, expected: set[str]):
-    suffix = Path(upload.filename).suffix.lower()
+VECTOR_EXTENSIONS = {".geojson", ".gpkg", ".parquet", ".fgb"}
+
+
+def check_suffix(suffix: str, expected: set[str]):
     if suffix not in expected:
         raise HTTPException(status_code=400, detail=f"Unsupported file type: {suffix or 'none'}, allowed: {', '.join(sorted(expected))}")
     return suffix
 
+
+def check_extension(upload: UploadFile, expected: set[str]):
+    return check_suffix(Path(upload.filename).suffix.lower(), expected)
+
+
+def check_input(name: str, upload: Optional[UploadFile], dataset_id: Optional[str], expected: set[str], required: bool = True):
+    if upload and dataset_id:
+        raise HTTPException(status_code=400, detail=f"Either upload {name} or reference a dataset, not both")
+    if upload:
+        check_extension(upload, expected)
+    elif dataset_id:
+        dataset = get_dataset(dataset_id)
+        if not dataset:
+            raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+        check_suffix(dataset["suffix"], expected)
+    elif required:
+        raise HTTPException(status_code=400, detail=f"Missing input: {name}")
+
+
+def effective_timeout(timeout: Optional[int]) -> Optional[int]:
+    limits = [t for t in (timeout, settings.job_timeout) if t]
+    return min(limits) if limits else None
+
+
+async def store_input(job_dir: Path, name: str, upload: Optional[UploadFile], dataset_id: Optional[str]):
+    if upload:
+        dataset = await store_upload(upload)
+    elif dataset_id:
+        dataset = get_dataset(dataset_id)
+    else:
+        return None, None
+    return link_dataset(dataset, job_dir, name), dataset["dataset_id"]
+
 # ----------------------------------------------------------------------------------------------------------------------
 # logging
 # ----------------------------------------------------------------------------------------------------------------------
@@ -92,9 +194,44 @@ logger = setup_logging()
 
 Job = Dict[str, Any]
 JOBS: Dict[str, Job] = {}
-JOB_QUEUE: "queue.Queue[str]" = queue.Queue()
+JOB_QUEUE = JobScheduler()
 JOBS_LOCK = threading.Lock()
 STOP_EVENT = threading.Event()
+JOB_EVENTS = JobEventBroker()
+CANCEL_TOKENS: Dict[str, CancelToken] = {}
+TERMINAL_STATUSES = {"done", "failed", "cancelled"}
+
+
+def count_running_jobs() -> int:
+    with JOBS_LOCK:
+        return sum(job["status"] == "running" for job in JOBS.values())
+
+
+register_gauge("citwin_queue_depth", "Jobs waiting in the queue", JOB_QUEUE.qsize)
+register_gauge("citwin_jobs_running", "Jobs currently running", count_running_jobs)
+register_gauge("citwin_process_resident_memory_bytes", "Resident memory of the API process, pipelines run inside it", current_rss)
+
+
+def publish_job(job: Job):
+    JOB_EVENTS.publish(job["job_id"], JobStatusOut(**job).model_dump(exclude_none=True))
+
+
+def start_job_trace(job: Job, start_ns: Optional[int] = None):
+    # the root span covers creation, queueing and the pipeline run, a retry starts a new root in the same trace
+    job["trace_id"] = job.get("trace_id") or new_trace_id()
+    job["trace_span_id"] = new_span_id()
+    job["trace_start_ns"] = start_ns or time.time_ns()
+    job["queued_ns"] = time.time_ns()
+
+
+def job_tracer(job: Job) -> Tracer:
+    return Tracer(Path(job["job_dir"]) / TRACES_FILE, job["trace_id"], job["trace_span_id"], scope="api")
+
+
+def end_job_trace(job: Job):
+    span = Span(job_tracer(job), "job", span_id=job["trace_span_id"], start_ns=job["trace_start_ns"], kind=SPAN_KIND_SERVER, attributes={"job_id": job["job_id"], "status": job["status"]})
+    span.end(error=job.get("error") if job["status"] != "done" else None)
+
 
 def job_worker():
     while not STOP_EVENT.is_set():
@@ -105,15 +242,22 @@ def job_worker():
 
         with JOBS_LOCK:
             job = JOBS.get(job_id)
-            if not job:
+            if not job or job["status"] != "queued":
                 JOB_QUEUE.task_done()
                 continue
+            cancel_token = CancelToken(timeout=job.get("timeout"))
+            CANCEL_TOKENS[job_id] = cancel_token
             job["status"] = "running"
             job["started_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            publish_job(job)
+        t0 = time.monotonic()
+        job_tracer(job).start_span("queue", start_ns=job["queued_ns"], attributes={"priority": JobPriority(job["priority"]).value}).end()
 
-        def progress_callback(step_message: str):
+        def progress_callback(step_message: str, progress: Optional[str] = None):
             with JOBS_LOCK:
                 job["step"] = step_message
+                job["progress"] = progress
+                publish_job(job)
 
         try:
             outputs = run_pipeline(
@@ -133,26 +277,115 @@ def job_worker():
 
                 netascore_gpkg=Path(job.get("netascore_gpkg")) if job.get("netascore_gpkg") else None,
                 output_format=job.get("output_format"),
+                layers=job.get("layers"),
                 seed=job.get("seed"),
+                streaming=job.get("streaming"),
+                flow_aggregation=job.get("flow_aggregation"),
+                time_budgets=job.get("time_budgets"),
+                index_thresholds=job.get("index_thresholds"),
+                replicates=job.get("replicates"),
+                coordinate_precision=job.get("coordinate_precision"),
+                downcast_floats=job.get("downcast_floats"),
+                feature_store=job.get("feature_store"),
+                tile_seed_max_zoom=job.get("tile_seed_max_zoom"),
+                checkpoints=job.get("checkpoints"),
+                resume=job.get("resume", False),
+                profile=job.get("profile", False),
+                spill=job.get("spill", False),
+                trace_parent=format_traceparent(job["trace_id"], job["trace_span_id"]),
+                base_job_dir=Path(job.get("base_job_dir")) if job.get("base_job_dir") else None,
 
                 job_dir=Path(job.get("job_dir")),
 
-                progress_callback=progress_callback
+                progress_callback=progress_callback,
+                cancel_token=cancel_token
             )
             with JOBS_LOCK:
                 job["status"] = "done"
                 job["step"] = None
+                job["progress"] = None
                 job["outputs"] = {k: str(v) for k, v in outputs.items()}
                 job["finished_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                if job.get("cache_key"):
+                    RESULT_CACHE[job["cache_key"]] = job_id
+                publish_job(job)
+        except PipelineCancelled as e:
+            with JOBS_LOCK:
+                job["status"] = "failed" if isinstance(e, PipelineTimeout) else "cancelled"
+                job["step"] = None
+                job["progress"] = None
+                job["error"] = str(e)
+                job["finished_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                publish_job(job)
         except Exception as e:
             with JOBS_LOCK:
                 job["status"] = "failed"
                 job["error"] = str(e)
                 job["traceback"] = traceback.format_exc()
                 job["finished_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                publish_job(job)
         finally:
+            with JOBS_LOCK:
+                CANCEL_TOKENS.pop(job_id, None)
+            register_parsed(job.get("datasets") or {}, Path(job["job_dir"]))
+            JOB_DURATION.observe(time.monotonic() - t0, status=job["status"])
+            end_job_trace(job)
             JOB_QUEUE.task_done()
 
+# ----------------------------------------------------------------------------------------------------------------------
+# result cache
+# ----------------------------------------------------------------------------------------------------------------------
+
+RESULT_CACHE: Dict[str, str] = {}  # cache key -> source job id
+TILE_CACHE = TileCache(max_size=settings.tile_cache_size)
+
+
+def result_cache_key(datasets: Dict[str, str], params: Dict[str, Any]) -> str:
+    payload = json.dumps({"datasets": datasets, "params": params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def find_cached_job(cache_key: str) -> Optional[Job]:
+    with JOBS_LOCK:
+        source = JOBS.get(RESULT_CACHE.get(cache_key))
+    if not source or source["status"] != "done":
+        return None
+    if not all(Path(path).exists() for path in source["outputs"].values()):
+        return None
+    return source
+
+
+def find_base_job(base_job_id: str) -> Job:
+    with JOBS_LOCK:
+        base_job = JOBS.get(base_job_id)
+        # cached jobs only link the outputs, the checkpoints are in the job that computed them
+        if base_job and base_job.get("cached_from"):
+            base_job = JOBS.get(base_job["cached_from"]) or base_job
+    if not base_job:
+        raise HTTPException(status_code=404, detail=f"Base job not found: {base_job_id}")
+    if base_job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"Base job not finished (status={base_job['status']})")
+    if not (Path(base_job["job_dir"]) / CHECKPOINTS_DIR).exists():
+        raise HTTPException(status_code=409, detail="Base job has no checkpoints to derive from")
+    return base_job
+
+
+def link_outputs(outputs: Dict[str, str], job_dir: Path) -> Dict[str, str]:
+    linked = {}
+    for key, path in outputs.items():
+        path = Path(path)
+        for src in [path, *(path.with_name(path.name + suffix) for suffix in SIDECAR_ENCODINGS.values())]:
+            dst = job_dir / src.name
+            if src.exists() and not dst.exists():
+                link_file(src, dst)
+        linked[key] = str(job_dir / path.name)
+
+    # the query store of non-GPKG results sits next to the outputs
+    for store in {Path(path).with_name(FEATURE_STORE) for path in outputs.values()}:
+        if store.exists() and not (job_dir / store.name).exists():
+            link_file(store, job_dir / store.name)
+    return linked
+
 # ----------------------------------------------------------------------------------------------------------------------
 # cleaner
 # ----------------------------------------------------------------------------------------------------------------------
@@ -168,8 +401,10 @@ def delete_old_jobs():
 
 def delete_old_jobs_periodically():
     delete_old_jobs()
+    delete_old_datasets()
     while not STOP_EVENT.is_set():
         time.sleep(3600)
+        delete_old_datasets()
         now = datetime.now(timezone.utc)
         with JOBS_LOCK:
             for job_id, job in list(JOBS.items()):
@@ -177,6 +412,9 @@ def delete_old_jobs_periodically():
                 if (now - created_at).total_seconds() > 31 * 24 * 3600:
                     shutil.rmtree(Path(job["job_dir"]), ignore_errors=True)
                     JOBS.pop(job_id, None)
+                    for cache_key, source_id in list(RESULT_CACHE.items()):
+                        if source_id == job_id:
+                            RESULT_CACHE.pop(cache_key, None)
 
 # ----------------------------------------------------------------------------------------------------------------------
 # worker + cleaner startup
@@ -184,6 +422,8 @@ def delete_old_jobs_periodically():
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
+    JOB_EVENTS.bind(asyncio.get_running_loop())
+
     worker_thread = threading.Thread(target=job_worker, daemon=True)
     cleaner_thread = threading.Thread(target=delete_old_jobs_periodically, daemon=True)
 
@@ -193,6 +433,9 @@ async def lifespan(_app: FastAPI):
     yield
 
     STOP_EVENT.set()
+    with JOBS_LOCK:
+        for cancel_token in CANCEL_TOKENS.values():
+            cancel_token.cancel()
 
     worker_thread.join(timeout=5)
     cleaner_thread.join(timeout=5)
@@ -212,7 +455,7 @@ app = FastAPI(
         "tryItOutEnabled": True,
     }
 )
-app.add_middleware(GZipMiddleware, minimum_size=1000)
+app.add_middleware(SelectiveGZipMiddleware, skip_paths=r"/jobs/[^/]+/(download/[^/]+|bundle)$", minimum_size=1000)
 
 # ----------------------------------------------------------------------------------------------------------------------
 
@@ -221,55 +464,141 @@ def health_check():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+def get_metrics() -> Response:
+    # prometheus text format, like /health without an api key so that scrapers need no credentials
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+
+@app.post("/datasets", response_model=DatasetOut, dependencies=[Depends(verify_api_key)])
+async def create_dataset(
+        file: UploadFile = File(..., description="Input file to register for reuse across jobs", examples=["b_klynger.gpkg"]),
+) -> DatasetOut:
+    check_extension(file, VECTOR_EXTENSIONS | {".csv"})
+    dataset = await store_upload(file)
+    return DatasetOut(**dataset)
+
+
+@app.get("/datasets/{dataset_id}", response_model=DatasetOut, dependencies=[Depends(verify_api_key)])
+def get_dataset_info(dataset_id: str) -> DatasetOut:
+    dataset = get_dataset(dataset_id)
+    if not dataset:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return DatasetOut(**dataset)
+
+
 @app.post("/jobs", response_model=JobCreateOut, dependencies=[Depends(verify_api_key)])
 async def create_job(
         request: Request,
-
-        od_clusters_a: UploadFile = File(..., description="Origin clusters file", examples=["b_klynger.gpkg"]),
-        od_clusters_b: UploadFile = File(..., description="Destination clusters file", examples=["a_klynger.gpkg"]),
-        od_table: UploadFile = File(..., description="Origin-destination table file", examples=["Data_2023_0099_Tabel_1.csv"]),
-        stops: UploadFile = File(..., description="Public transport stops file", examples=["dynlayer.gpkg"]),
-
-        od_clusters_a_id_field: str = Form(..., description="ID field for origin clusters", examples=["klynge_id"]),
-        od_clusters_a_count_field: str = Form(..., description="Count field for origin clusters", examples=["Beboere"]),
-        od_clusters_b_id_field: str = Form(..., description="ID field for destination clusters", examples=["klynge_id"]),
-        od_clusters_b_count_field: str = Form(..., description="Count field for destination clusters", examples=["Arbejdere"]),
-        od_table_a_id_field: str = Form(..., description="ID field for origin clusters in origin-destination table", examples=["Bopael_klynge_id"]),
-        od_table_b_id_field: str = Form(..., description="ID field for destination clusters in origin-destination table", examples=["Arbejssted_klynge_id"]),
-        od_table_trips_field: str = Form(..., description="Trips field in origin-destination table", examples=["Antal"]),
+        api_key: str = Security(api_key_header),
+
+        od_clusters_a: Optional[UploadFile] = File(None, description="Origin clusters file", examples=["b_klynger.gpkg"]),
+        od_clusters_b: Optional[UploadFile] = File(None, description="Destination clusters file", examples=["a_klynger.gpkg"]),
+        od_table: Optional[UploadFile] = File(None, description="Origin-destination table file", examples=["Data_2023_0099_Tabel_1.csv"]),
+        stops: Optional[UploadFile] = File(None, description="Public transport stops file", examples=["dynlayer.gpkg"]),
+
+        od_clusters_a_dataset_id: Optional[str] = Form(None, description="Registered dataset to use as origin clusters file"),
+        od_clusters_b_dataset_id: Optional[str] = Form(None, description="Registered dataset to use as destination clusters file"),
+        od_table_dataset_id: Optional[str] = Form(None, description="Registered dataset to use as origin-destination table file"),
+        stops_dataset_id: Optional[str] = Form(None, description="Registered dataset to use as public transport stops file"),
+
+        od_clusters_a_id_field: Optional[str] = Form(None, description="ID field for origin clusters", examples=["klynge_id"]),
+        od_clusters_a_count_field: Optional[str] = Form(None, description="Count field for origin clusters", examples=["Beboere"]),
+        od_clusters_b_id_field: Optional[str] = Form(None, description="ID field for destination clusters", examples=["klynge_id"]),
+        od_clusters_b_count_field: Optional[str] = Form(None, description="Count field for destination clusters", examples=["Arbejdere"]),
+        od_table_a_id_field: Optional[str] = Form(None, description="ID field for origin clusters in origin-destination table", examples=["Bopael_klynge_id"]),
+        od_table_b_id_field: Optional[str] = Form(None, description="ID field for destination clusters in origin-destination table", examples=["Arbejssted_klynge_id"]),
+        od_table_trips_field: Optional[str] = Form(None, description="Trips field in origin-destination table", examples=["Antal"]),
         stops_id_field: str = Form(..., description="ID field for public transport stops", examples=["stopnummer"]),
+        base_job_id: Optional[str] = Form(None, description="Finished job with checkpoints to derive from: its points, network, graphs and distances are reused and only added or moved stops are evaluated. Only stops are read from this request"),
 
         netascore_gpkg: Optional[UploadFile] = File(None, description="Pre-generated netascore file"),
+        netascore_gpkg_dataset_id: Optional[str] = Form(None, description="Registered dataset to use as pre-generated netascore file"),
         output_format: Optional[OutputFormat] = Form(OutputFormat.geojson, description="Output format"),
+        layers: Optional[List[OutputLayer]] = Form(None, description="Output layers to export, defaults to stops_updated and households. edges, stop_edges, household_points and stop_households hold the normalized schema without duplicated geometries"),
         seed: Optional[int] = Form(None, description="Random seed for reproducibility of results"),
+        streaming: bool = Form(False, description="Write households and routes in batches while stops are evaluated, keeps memory bounded for large jobs"),
+        flow_aggregation: FlowAggregation = Form(FlowAggregation.overall, description="Aggregate edge flows over all stops or per stop"),
+        time_budgets: Optional[List[float]] = Form(None, description=f"Travel time budgets in minutes for the stops_sweep layer, at most and by default {DISTANCE_TIME_BUDGET}", examples=[[5, 10, 15]]),
+        replicates: int = Form(1, ge=1, le=100, description="Household draws to evaluate, stops_updated reports mean, std and percentiles of households_ratio over them"),
+        index_thresholds: Optional[List[float]] = Form(None, description="Bike index thresholds of the quality network for the stops_sweep layer, defaults to 0.5", examples=[[0.3, 0.5, 0.7]]),
+        coordinate_precision: Optional[int] = Form(None, ge=0, le=15, description="Decimal places of output coordinates, 7 is about 1 cm in WGS84"),
+        downcast_floats: bool = Form(False, description="Write lengths, ratios and indices as 32-bit floats"),
+        feature_store: bool = Form(True, description="Build a spatially indexed store for /jobs/{job_id}/features queries and tiles"),
+        tile_seed_max_zoom: Optional[int] = Form(None, ge=0, le=14, description="Pre-render vector tiles up to this zoom level at export"),
+        checkpoints: bool = Form(False, description="Persist the results of each step in the job directory so that failed jobs can be resumed with /jobs/{job_id}/retry and later jobs can derive from this one, about doubles the disk use of a job"),
+        spill: bool = Form(False, description="Keep large intermediate frames in memory-mapped Arrow files in the job directory between steps"),
+        profile: bool = Form(False, description="Add allocation tracing and stack sampling to the step profile in /jobs/{job_id}/profile, slows the job down"),
+        timeout: Optional[int] = Form(None, gt=0, description="Wall-clock timeout in seconds, capped by the server limit"),
+        priority: JobPriority = Form(JobPriority.normal, description="Scheduling priority class"),
 ) -> JobCreateOut:
+    # multipart bodies are parsed before the handler runs, the span starts with storing the uploads
+    trace_start_ns = time.time_ns()
+    inputs = {
+        "od_clusters_a": (od_clusters_a, od_clusters_a_dataset_id),
+        "od_clusters_b": (od_clusters_b, od_clusters_b_dataset_id),
+        "od_table": (od_table, od_table_dataset_id),
+        "stops": (stops, stops_dataset_id),
+        "netascore": (netascore_gpkg, netascore_gpkg_dataset_id),
+    }
+    fields = {
+        "od_clusters_a_id_field": od_clusters_a_id_field,
+        "od_clusters_a_count_field": od_clusters_a_count_field,
+        "od_clusters_b_id_field": od_clusters_b_id_field,
+        "od_clusters_b_count_field": od_clusters_b_count_field,
+        "od_table_a_id_field": od_table_a_id_field,
+        "od_table_b_id_field": od_table_b_id_field,
+        "od_table_trips_field": od_table_trips_field,
+    }
+
+    check_input("stops", *inputs["stops"], VECTOR_EXTENSIONS)
+    if time_budgets and not all(0 < budget <= DISTANCE_TIME_BUDGET for budget in time_budgets):
+        raise HTTPException(status_code=400, detail=f"Time budgets must be positive and at most {DISTANCE_TIME_BUDGET} min")
+    if index_thresholds and not all(0 <= threshold <= 1 for threshold in index_thresholds):
+        raise HTTPException(status_code=400, detail="Index thresholds must be between 0 and 1")
+    base_job = find_base_job(base_job_id) if base_job_id else None
+    if base_job:
+        # inputs and fields other than the stops come from the base job
+        given = [name for name, (upload, dataset_id) in inputs.items() if name != "stops" and (upload or dataset_id)]
+        given += [name for name, value in fields.items() if value is not None]
+        if given:
+            raise HTTPException(status_code=400, detail=f"Derived jobs take these from the base job: {', '.join(given)}")
+        fields = {name: base_job[name] for name in fields}
+    else:
+        check_input("od_clusters_a", *inputs["od_clusters_a"], VECTOR_EXTENSIONS)
+        check_input("od_clusters_b", *inputs["od_clusters_b"], VECTOR_EXTENSIONS)
+        check_input("od_table", *inputs["od_table"], {".csv"})
+        check_input("netascore_gpkg", *inputs["netascore"], {".gpkg"}, required=False)
+        missing = [name for name, value in fields.items() if value is None]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Missing fields: {', '.join(missing)}")
+
     job_id = str(uuid.uuid4())
     job_dir = (JOBS_DIR / job_id)
     job_dir.mkdir(parents=True, exist_ok=True)
 
-    check_extension(od_clusters_a, {".geojson", ".gpkg"})
-    check_extension(od_clusters_b, {".geojson", ".gpkg"})
-    check_extension(od_table, {".csv"})
-    check_extension(stops, {".geojson", ".gpkg"})
-    if netascore_gpkg:
-        check_extension(netascore_gpkg, {".gpkg"})
-
-    od_clusters_a_path = job_dir / f"od_clusters_a{Path(od_clusters_a.filename).suffix}"
-    od_clusters_a_path.write_bytes(await od_clusters_a.read())
-
-    od_clusters_b_path = job_dir / f"od_clusters_b{Path(od_clusters_b.filename).suffix}"
-    od_clusters_b_path.write_bytes(await od_clusters_b.read())
-
-    od_table_path = job_dir / f"od_table{Path(od_table.filename).suffix}"
-    od_table_path.write_bytes(await od_table.read())
+    paths, datasets = {}, {}
+    for name, (upload, dataset_id) in inputs.items():
+        paths[name], datasets[name] = await store_input(job_dir, name, upload, dataset_id)
+    if base_job:
+        for name, key in [("od_clusters_a", "od_clusters_a"), ("od_clusters_b", "od_clusters_b"), ("od_table", "od_table"), ("netascore", "netascore_gpkg")]:
+            paths[name] = Path(base_job[key]) if base_job[key] else None
 
-    stops_path = job_dir / f"stops{Path(stops.filename).suffix}"
-    stops_path.write_bytes(await stops.read())
+    params = {
+        **fields,
+        "stops_id_field": stops_id_field,
 
-    netascore_gpkg_path = None
-    if netascore_gpkg:
-        netascore_gpkg_path = job_dir / f"netascore{Path(netascore_gpkg.filename).suffix}"
-        netascore_gpkg_path.write_bytes(await netascore_gpkg.read())
+        "output_format": output_format,
+        "layers": sorted(layer.value for layer in layers) if layers else None,
+        "seed": seed,
+        "flow_aggregation": flow_aggregation,
+        "time_budgets": sorted(set(time_budgets)) if time_budgets else None,
+        "index_thresholds": sorted(set(index_thresholds)) if index_thresholds else None,
+        "replicates": replicates,
+        "coordinate_precision": coordinate_precision,
+        "downcast_floats": downcast_floats,
+        "feature_store": feature_store,
+    }
 
     job = {
         "job_id": job_id,
@@ -278,28 +607,59 @@ async def create_job(
         "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
         "job_dir": str(job_dir),
 
-        "od_clusters_a": str(od_clusters_a_path),
-        "od_clusters_b": str(od_clusters_b_path),
-        "od_table": str(od_table_path),
-        "stops": str(stops_path),
-
-        "od_clusters_a_id_field": od_clusters_a_id_field,
-        "od_clusters_a_count_field": od_clusters_a_count_field,
-        "od_clusters_b_id_field": od_clusters_b_id_field,
-        "od_clusters_b_count_field": od_clusters_b_count_field,
-        "od_table_a_id_field": od_table_a_id_field,
-        "od_table_b_id_field": od_table_b_id_field,
-        "od_table_trips_field": od_table_trips_field,
-        "stops_id_field": stops_id_field,
-
-        "netascore_gpkg": str(netascore_gpkg_path) if netascore_gpkg_path else None,
-        "output_format": output_format,
-        "seed": seed,
+        "od_clusters_a": str(paths["od_clusters_a"]),
+        "od_clusters_b": str(paths["od_clusters_b"]),
+        "od_table": str(paths["od_table"]),
+        "stops": str(paths["stops"]),
+        "netascore_gpkg": str(paths["netascore"]) if paths["netascore"] else None,
+        "datasets": {name: dataset_id for name, dataset_id in datasets.items() if dataset_id},
+
+        **params,
+        "streaming": streaming,
+        "tile_seed_max_zoom": tile_seed_max_zoom,
+        "checkpoints": checkpoints,
+        "profile": profile,
+        "spill": spill,
+        "base_job_id": base_job["job_id"] if base_job else None,
+        "base_job_dir": base_job["job_dir"] if base_job else None,
+        "timeout": effective_timeout(timeout),
+        "priority": priority,
     }
 
+    # results are only reproducible with a fixed seed and an uploaded network, jobs without one generate it from
+    # the current osm data; derived jobs depend on the base job's points, profiled jobs are run to be measured
+    if seed is not None and datasets["netascore"] and not base_job and not profile:
+        job["cache_key"] = result_cache_key(job["datasets"], params)
+        source = find_cached_job(job["cache_key"])
+        if source:
+            job["status"] = "done"
+            job["outputs"] = link_outputs(source["outputs"], job_dir)
+            job["cached_from"] = source["job_id"]
+            job["started_at"] = job["finished_at"] = job["created_at"]
+
+    if job["status"] == "queued":
+        # the estimate reads every input, off the event loop that serves the progress streams
+        try:
+            job["estimated_cost"] = await run_in_threadpool(
+                estimate_job_cost, paths["od_clusters_a"], paths["od_table"], paths["stops"], paths["netascore"], derived=bool(base_job)
+            )
+        except ValueError as e:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise HTTPException(status_code=400, detail=str(e))
+        if settings.job_cost_budget is not None and job["estimated_cost"] > settings.job_cost_budget:
+            shutil.rmtree(job_dir, ignore_errors=True)
+            raise HTTPException(status_code=413, detail=f"Estimated job cost {job['estimated_cost']:.0f} exceeds budget {settings.job_cost_budget:.0f}")
+
+    start_job_trace(job, trace_start_ns)
+    uploads = [name for name, (upload, _) in inputs.items() if upload]
+    job_tracer(job).start_span("create_job", start_ns=trace_start_ns, kind=SPAN_KIND_SERVER, attributes={"uploads": ",".join(uploads), "cached": "cached_from" in job}).end()
+    if job["status"] == "done":
+        end_job_trace(job)
+
     with JOBS_LOCK:
         JOBS[job_id] = job
-    JOB_QUEUE.put(job_id)
+    if job["status"] == "queued":
+        JOB_QUEUE.put(job_id, cost=job["estimated_cost"], priority=priority, tenant=api_key_tenant(api_key))
 
     base_url = str(request.base_url).rstrip("/")
     root_path = request.scope.get("root_path", "").rstrip("/")
@@ -309,11 +669,63 @@ async def create_job(
 
 
 @app.get("/jobs/{job_id}", response_model=JobStatusOut, response_model_exclude_none=True, dependencies=[Depends(verify_api_key)])
-def get_job_status(job_id: str) -> JobStatusOut:
+def get_job_status(job_id: str, include_summary: bool = Query(False, description="Include the result summary of finished jobs")) -> JobStatusOut:
     with JOBS_LOCK:
         job = JOBS.get(job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+
+    summary = None
+    summary_path = (job.get("outputs") or {}).get("summary")
+    if include_summary and summary_path and Path(summary_path).exists():
+        summary = json.loads(Path(summary_path).read_text(encoding="utf-8"))
+    return JobStatusOut(**job, summary=summary)
+
+
+@app.delete("/jobs/{job_id}", response_model=JobStatusOut, response_model_exclude_none=True, dependencies=[Depends(verify_api_key)])
+def cancel_job(job_id: str) -> JobStatusOut:
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job["status"] in TERMINAL_STATUSES:
+            raise HTTPException(status_code=409, detail=f"Job already finished (status={job['status']})")
+
+        if job["status"] == "queued":
+            JOB_QUEUE.remove(job_id)
+            job["status"] = "cancelled"
+            job["finished_at"] = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            publish_job(job)
+            end_job_trace(job)
+        else:
+            # the worker marks the job as cancelled once the pipeline has stopped
+            CANCEL_TOKENS[job_id].cancel()
+
+        return JobStatusOut(**job)
+
+
+@app.post("/jobs/{job_id}/retry", response_model=JobStatusOut, response_model_exclude_none=True, dependencies=[Depends(verify_api_key)])
+def retry_job(job_id: str, api_key: str = Security(api_key_header)) -> JobStatusOut:
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+        if not job:
+            raise HTTPException(status_code=404, detail="Job not found")
+        if job["status"] not in {"failed", "cancelled"}:
+            raise HTTPException(status_code=409, detail=f"Only failed or cancelled jobs can be retried (status={job['status']})")
+        if not Path(job["job_dir"]).exists():
+            raise HTTPException(status_code=410, detail="Job directory no longer exists")
+
+        # the pipeline resumes from the first step without a valid checkpoint
+        for key in ("error", "traceback", "started_at", "finished_at"):
+            job.pop(key, None)
+        job["status"] = "queued"
+        job["step"] = None
+        job["progress"] = None
+        job["resume"] = True
+        start_job_trace(job)
+        publish_job(job)
+
+    JOB_QUEUE.put(job_id, cost=job.get("estimated_cost") or 0.0, priority=job["priority"], tenant=api_key_tenant(api_key))
     return JobStatusOut(**job)
 
 
@@ -341,7 +753,7 @@ def get_job_downloads(job_id: str) -> JobDownloadsOut:
 
 
 @app.get("/jobs/{job_id}/download/{key}", dependencies=[Depends(verify_api_key)])
-def download_output(job_id: str, key: str) -> FileResponse:
+def download_output(request: Request, job_id: str, key: str) -> FileResponse:
     with JOBS_LOCK:
         job = JOBS.get(job_id)
     if not job:
@@ -358,20 +770,216 @@ def download_output(job_id: str, key: str) -> FileResponse:
     if not out_path.exists():
         raise HTTPException(status_code=500, detail="File not found")
 
-    return FileResponse(out_path, filename=out_path.name)
+    # pre-compressed sidecars are served as-is, FileResponse takes care of ETag and byte ranges
+    encoding, serve_path = negotiate_encoding(request.headers.get("accept-encoding", ""), out_path)
+    stat = serve_path.stat()
+    headers = {"Vary": "Accept-Encoding", "ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-{encoding or "identity"}"'}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+
+    if headers["ETag"] in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    # range requests are left out, resumed downloads would count the same file more than once
+    if "range" not in request.headers:
+        DOWNLOAD_BYTES.inc(stat.st_size, encoding=encoding or "identity")
+    return FileResponse(serve_path, filename=out_path.name, headers=headers, stat_result=stat)
+
+
+@app.get("/jobs/{job_id}/summary", dependencies=[Depends(verify_api_key)])
+def get_job_summary(
+        request: Request,
+        job_id: str,
+        format: SummaryFormat = Query(SummaryFormat.json, description="json, or arrow for the per-stop table as an Arrow IPC stream"),
+) -> Response:
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.get("status") != "done":
+        raise HTTPException(status_code=409, detail=f"Job not finished (status={job.get('status')})")
+
+    summary_path = (job.get("outputs") or {}).get("summary")
+    if not summary_path or not Path(summary_path).exists():
+        raise HTTPException(status_code=404, detail="Summary not found")
+
+    # the summary is written once at export, its content does not change afterwards
+    summary_path = Path(summary_path)
+    stat = summary_path.stat()
+    headers = {"ETag": f'"{stat.st_mtime_ns:x}-{stat.st_size:x}-{format.value}"', "Cache-Control": "private, max-age=0, must-revalidate"}
+    if headers["ETag"] in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    if format == SummaryFormat.arrow:
+        summary = json.loads(summary_path.read_text(encoding="utf-8"))
+        return Response(summary_to_arrow(summary), media_type="application/vnd.apache.arrow.stream", headers=headers)
+    return Response(summary_path.read_bytes(), media_type="application/json", headers=headers)
+
+
+@app.get("/jobs/{job_id}/profile", dependencies=[Depends(verify_api_key)])
+def get_job_profile(
+        job_id: str,
+        step: Optional[int] = Query(None, ge=1, description="Step index, returns the sampled stacks of this step in collapsed flame graph format"),
+) -> Response:
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # rewritten after every step, running and failed jobs show the steps finished so far
+    profile_path = Path(job["job_dir"]) / PROFILE_FILE
+    if not profile_path.exists():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if step is None:
+        return Response(profile_path.read_bytes(), media_type="application/json")
+
+    profile = json.loads(profile_path.read_text(encoding="utf-8"))
+    stacks = next((s.get("stacks") for s in profile["steps"] if s["idx"] == step), None)
+    if not stacks:
+        raise HTTPException(status_code=404, detail="No sampled stacks for this step, create the job with profile=true")
+    return Response((Path(job["job_dir"]) / stacks).read_bytes(), media_type="text/plain")
+
+
+@app.get("/jobs/{job_id}/features/{layer}", dependencies=[Depends(verify_api_key)])
+def get_job_features(
+        job_id: str,
+        layer: OutputLayer,
+        bbox: Optional[str] = Query(None, description="Bounding box minx,miny,maxx,maxy in the output CRS", examples=["12.49,55.62,12.51,55.64"]),
+        stop_id: Optional[str] = Query(None, description="Only features of this stop"),
+        fields: Optional[str] = Query(None, description="Comma-separated attribute fields to return", examples=["stop_id,households_ratio"]),
+        cursor: Optional[int] = Query(None, ge=0, description="next_cursor of the previous page"),
+        limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+) -> JSONResponse:
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.get("status") != "done":
+        raise HTTPException(status_code=409, detail=f"Job not finished (status={job.get('status')})")
+
+    store = find_feature_store(job.get("outputs") or {}, layer.value)
+    info = layer_info(store, layer.value) if store else None
+    if not info:
+        raise HTTPException(status_code=404, detail=f"Layer not available for querying: {layer.value}")
+
+    bbox_values = None
+    if bbox is not None:
+        bbox_values = parse_bbox(bbox)
+        if bbox_values is None:
+            raise HTTPException(status_code=400, detail="Invalid bbox, expected minx,miny,maxx,maxy")
+        if not info["geometry_name"]:
+            raise HTTPException(status_code=400, detail=f"Layer has no geometry: {layer.value}")
+
+    if stop_id is not None and "stop_id" not in info["fields"]:
+        raise HTTPException(status_code=400, detail=f"Layer has no stop_id field: {layer.value}")
+
+    field_list = None
+    if fields is not None:
+        field_list = [field.strip() for field in fields.split(",") if field.strip()]
+        unknown_fields = set(field_list) - set(info["fields"])
+        if unknown_fields:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown_fields))}")
+
+    df, next_cursor = query_features(store, layer.value, info, bbox=bbox_values, stop_id=stop_id, fields=field_list, cursor=cursor, limit=limit)
+    return JSONResponse(feature_collection(df, next_cursor))
+
+
+@app.get("/jobs/{job_id}/tiles/{layer}/{z}/{x}/{y}.mvt", dependencies=[Depends(verify_api_key)])
+def get_job_tile(job_id: str, layer: OutputLayer, z: int, x: int, y: int) -> Response:
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.get("status") != "done":
+        raise HTTPException(status_code=409, detail=f"Job not finished (status={job.get('status')})")
+    if not 0 <= z <= MAX_ZOOM or not 0 <= x < 2 ** z or not 0 <= y < 2 ** z:
+        raise HTTPException(status_code=404, detail="Tile out of range")
+
+    key = (job_id, layer.value, z, x, y)
+    tile = TILE_CACHE.get(key)
+    if tile is None:
+        seeded = tile_path(Path(job["job_dir"]) / TILES_DIR, layer.value, z, x, y)
+        if seeded.exists():
+            tile = seeded.read_bytes()
+        else:
+            store = find_feature_store(job.get("outputs") or {}, layer.value)
+            info = layer_info(store, layer.value) if store else None
+            if not info:
+                raise HTTPException(status_code=404, detail=f"Layer not available for tiles: {layer.value}")
+            if not info["geometry_name"]:
+                raise HTTPException(status_code=400, detail=f"Layer has no geometry: {layer.value}")
+            tile = render_tile(store, layer.value, z, x, y, crs=info["crs"])
+        TILE_CACHE.put(key, tile)
+
+    if not tile:
+        return Response(status_code=204)
+    return Response(tile, media_type=TILE_MEDIA_TYPE)
+
+
+@app.get("/jobs/{job_id}/bundle", dependencies=[Depends(verify_api_key)])
+def download_bundle(job_id: str) -> StreamingResponse:
+    with JOBS_LOCK:
+        job = JOBS.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.get("status") != "done":
+        raise HTTPException(status_code=409, detail=f"Job not finished (status={job.get('status')})")
+
+    # layers sharing a container are bundled once
+    paths = {Path(path) for path in (job.get("outputs") or {}).values()}
+    files = {path.name: path for path in sorted(paths) if path.exists()}
+
+    return StreamingResponse(
+        stream_zip(files),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{job_id}.zip"'},
+    )
+
+
+@app.get("/jobs/{job_id}/events", dependencies=[Depends(verify_api_key)])
+async def sse_job_events(job_id: str) -> StreamingResponse:
+    with JOBS_LOCK:
+        if job_id not in JOBS:
+            raise HTTPException(status_code=404, detail="Job not found")
+
+    async def event_stream():
+        events = JOB_EVENTS.subscribe(job_id)
+        try:
+            with JOBS_LOCK:
+                status = JobStatusOut(**JOBS[job_id]).model_dump(exclude_none=True)
+            yield f"event: status\ndata: {json.dumps(status)}\n\n"
+            while status["status"] not in TERMINAL_STATUSES:
+                try:
+                    status = await asyncio.wait_for(events.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: status\ndata: {json.dumps(status)}\n\n"
+        finally:
+            JOB_EVENTS.unsubscribe(job_id, events)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.websocket("/ws/{job_id}")
 async def ws_job_done(websocket: WebSocket, job_id: str):
     await websocket.accept()
+    events = JOB_EVENTS.subscribe(job_id)
     try:
-        while True:
-            with JOBS_LOCK:
-                job = JOBS.get(job_id)
-                if job and job["status"] in {"done", "failed"}:
-                    break
-            await asyncio.sleep(1)
-
-        await websocket.send_json(JobStatusOut(**job).model_dump(exclude_none=True))
+        with JOBS_LOCK:
+            job = JOBS.get(job_id)
+            status = JobStatusOut(**job).model_dump(exclude_none=True) if job else None
+        if status is None:
+            await websocket.close(code=4404, reason="Job not found")
+            return
+
+        await websocket.send_json(status)
+        while status["status"] not in TERMINAL_STATUSES:
+            status = await events.get()
+            await websocket.send_json(status)
+    except WebSocketDisconnect:
+        pass
     finally:
-        await websocket.close()
+        JOB_EVENTS.unsubscribe(job_id, events)
+        if websocket.client_state == WebSocketState.CONNECTED and websocket.application_state == WebSocketState.CONNECTED:
+            await websocket.close()
@@ -1,11 +1,13 @@
 import os
 from pathlib import Path
+from typing import List, Optional
 
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     api_key: str
+    api_keys: List[str] = []
     db_host: str
     db_port: int
     db_name: str
@@ -13,6 +15,9 @@ class Settings(BaseSettings):
     db_password: str
 
     api_root_path: str = "/"
+    job_timeout: Optional[int] = None
+    job_cost_budget: Optional[float] = None
+    tile_cache_size: int = 4096
 
     class Config:
         env_file = [
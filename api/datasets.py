@@ -0,0 +1,142 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from fastapi import UploadFile
+
+from api.metrics import UPLOAD_BYTES, UPLOAD_SECONDS
+from api.paths import DATASETS_DIR
+
+CHUNK_SIZE = 1024 * 1024
+PARSED_SUFFIXES = {".geojson", ".gpkg"}
+DATASET_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+logger = logging.getLogger(__name__)
+
+Dataset = Dict[str, Any]
+
+# ----------------------------------------------------------------------------------------------------------------------
+# registry
+# ----------------------------------------------------------------------------------------------------------------------
+
+def dataset_dir(dataset_id: str) -> Path:
+    return DATASETS_DIR / dataset_id
+
+
+def get_dataset(dataset_id: str) -> Optional[Dataset]:
+    if not DATASET_ID_PATTERN.match(dataset_id):
+        return None
+    meta_path = dataset_dir(dataset_id) / "meta.json"
+    if not meta_path.exists():
+        return None
+    return json.loads(meta_path.read_text(encoding="utf-8"))
+
+
+async def store_upload(upload: UploadFile) -> Dataset:
+    suffix = Path(upload.filename).suffix.lower()
+    tmp_dir = DATASETS_DIR / f".tmp-{uuid.uuid4()}"
+    tmp_dir.mkdir(parents=True)
+
+    # stream to disk while hashing, the upload is never held in memory as a whole
+    sha256 = hashlib.sha256()
+    size = 0
+    t0 = time.monotonic()
+    with open(tmp_dir / f"raw{suffix}", "wb") as f:
+        while chunk := await upload.read(CHUNK_SIZE):
+            sha256.update(chunk)
+            f.write(chunk)
+            size += len(chunk)
+    UPLOAD_BYTES.inc(size)
+    UPLOAD_SECONDS.inc(time.monotonic() - t0)
+
+    dataset = {
+        "dataset_id": sha256.hexdigest(),
+        "filename": upload.filename,
+        "suffix": suffix,
+        "size": size,
+        "created_at": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+    }
+    (tmp_dir / "meta.json").write_text(json.dumps(dataset), encoding="utf-8")
+
+    # the rename is atomic, a concurrent upload of the same content loses the race and reuses the registered dataset
+    try:
+        tmp_dir.rename(dataset_dir(dataset["dataset_id"]))
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return get_dataset(dataset["dataset_id"])
+
+    return dataset
+
+
+def raw_path(dataset: Dataset) -> Path:
+    return dataset_dir(dataset["dataset_id"]) / f"raw{dataset['suffix']}"
+
+# ----------------------------------------------------------------------------------------------------------------------
+# parsed forms
+# ----------------------------------------------------------------------------------------------------------------------
+
+def register_parsed(datasets: Dict[str, str], job_dir: Path) -> None:
+    # the pipeline writes the parsed form of the frames it reads next to the job's inputs, e.g. netascore.edge.parquet,
+    # they are linked back into the dataset so that later jobs skip parsing the raw file
+    for name, dataset_id in datasets.items():
+        dataset = get_dataset(dataset_id)
+        if dataset is None or dataset["suffix"] not in PARSED_SUFFIXES:
+            continue
+        raw = raw_path(dataset)
+        for parsed in [*job_dir.glob(f"{name}.parquet"), *job_dir.glob(f"{name}.*.parquet")]:
+            dst = raw.with_name(parsed.name.replace(name, "parsed", 1))
+            if dst.exists():
+                continue
+            tmp_path = dst.with_name(f".tmp-{uuid.uuid4()}.parquet")
+            try:
+                link_file(parsed, tmp_path)
+                os.replace(tmp_path, dst)
+            except OSError as e:
+                tmp_path.unlink(missing_ok=True)
+                logger.warning(f"– registering parsed form {parsed.name} of dataset {dataset_id} failed: {e}")
+
+# ----------------------------------------------------------------------------------------------------------------------
+# job inputs
+# ----------------------------------------------------------------------------------------------------------------------
+
+def link_file(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def link_dataset(dataset: Dataset, job_dir: Path, name: str) -> Path:
+    raw = raw_path(dataset)
+    dst = job_dir / f"{name}{dataset['suffix']}"
+    link_file(raw, dst)
+
+    # parsed forms follow the raw file, e.g. parsed.edge.parquet -> netascore.edge.parquet
+    for parsed in raw.parent.glob("parsed*.parquet"):
+        link_file(parsed, job_dir / parsed.name.replace("parsed", name, 1))
+
+    # last use drives eviction
+    os.utime(raw.parent / "meta.json")
+    return dst
+
+# ----------------------------------------------------------------------------------------------------------------------
+# cleaner
+# ----------------------------------------------------------------------------------------------------------------------
+
+def delete_old_datasets(max_age: float = 31 * 24 * 3600) -> None:
+    now = time.time()
+    for path in DATASETS_DIR.iterdir():
+        if not path.is_dir():
+            continue
+        meta_path = path / "meta.json"
+        last_used = meta_path.stat().st_mtime if meta_path.exists() else path.stat().st_ctime
+        if now - last_used > max_age:
+            shutil.rmtree(path, ignore_errors=True)
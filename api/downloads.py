@@ -0,0 +1,82 @@
+import io
+import re
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterator, Optional, Tuple
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import Receive, Scope, Send
+
+from pipeline.steps.export_results import SIDECAR_ENCODINGS
+
+CHUNK_SIZE = 1024 * 1024
+
+# ----------------------------------------------------------------------------------------------------------------------
+# content negotiation
+# ----------------------------------------------------------------------------------------------------------------------
+
+def accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    encodings = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        match = re.search(r"q=([0-9.]+)", params)
+        encodings[name.strip().lower()] = float(match.group(1)) if match else 1.0
+    return encodings
+
+
+def negotiate_encoding(accept_encoding: str, path: Path) -> Tuple[Optional[str], Path]:
+    accepted = accepted_encodings(accept_encoding)
+    # sidecars are listed in order of preference
+    for encoding, suffix in SIDECAR_ENCODINGS.items():
+        sidecar = path.with_name(path.name + suffix)
+        if accepted.get(encoding, accepted.get("*", 0)) > 0 and sidecar.exists():
+            return encoding, sidecar
+    return None, path
+
+
+class SelectiveGZipMiddleware(GZipMiddleware):
+    # file downloads are served pre-compressed or as-is, compressing them on the fly only burns CPU
+    def __init__(self, app, skip_paths: str, **kwargs):
+        super().__init__(app, **kwargs)
+        self.skip_paths = re.compile(skip_paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http" and self.skip_paths.search(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# zip bundle
+# ----------------------------------------------------------------------------------------------------------------------
+
+class ZipStream(io.RawIOBase):
+    # write-only, unseekable sink, zipfile falls back to data descriptors
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def pop(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_zip(files: Dict[str, Path]) -> Iterator[bytes]:
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_STORED) as zf:
+        for arcname, path in files.items():
+            with open(path, "rb") as src, zf.open(arcname, mode="w", force_zip64=True) as dst:
+                while chunk := src.read(CHUNK_SIZE):
+                    dst.write(chunk)
+                    yield stream.pop()
+    yield stream.pop()
@@ -0,0 +1,40 @@
+import asyncio
+from typing import Any, Dict, Optional, Set
+
+Event = Dict[str, Any]
+
+
+class JobEventBroker:
+    def __init__(self, max_queue_size: int = 100):
+        self.max_queue_size = max_queue_size
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+
+    def publish(self, job_id: str, event: Event) -> None:
+        # safe to call from worker threads, delivery happens on the event loop
+        if self.loop is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._dispatch, job_id, event)
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self.subscribers.setdefault(job_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        queues = self.subscribers.get(job_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            self.subscribers.pop(job_id, None)
+
+    def _dispatch(self, job_id: str, event: Event) -> None:
+        for queue in self.subscribers.get(job_id, ()):
+            # slow consumers lose the oldest progress updates, never the latest status
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(event)
@@ -0,0 +1,105 @@
+import json
+import math
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import geopandas as gpd
+import pandas as pd
+import pyogrio
+from pyogrio.errors import DataLayerError, DataSourceError
+
+from pipeline.steps.export_results import FEATURE_STORE
+
+MAX_PAGE_SIZE = 1000
+
+# ----------------------------------------------------------------------------------------------------------------------
+# feature store
+# ----------------------------------------------------------------------------------------------------------------------
+
+def find_feature_store(outputs: Dict[str, str], layer: str) -> Optional[Path]:
+    if layer not in outputs:
+        return None
+    path = Path(outputs[layer])
+    store = path if path.suffix == ".gpkg" else path.with_name(FEATURE_STORE)
+    return store if store.exists() else None
+
+
+def layer_info(store: Path, layer: str) -> Optional[Dict[str, Any]]:
+    try:
+        return pyogrio.read_info(store, layer=layer)
+    except (DataLayerError, DataSourceError):
+        return None
+
+
+def parse_bbox(bbox: str) -> Optional[Tuple[float, float, float, float]]:
+    try:
+        minx, miny, maxx, maxy = (float(value) for value in bbox.split(","))
+    except ValueError:
+        return None
+    # nan and inf parse as floats but would end up as column names in the sql filter
+    if not all(math.isfinite(value) for value in (minx, miny, maxx, maxy)):
+        return None
+    if minx > maxx or miny > maxy:
+        return None
+    return minx, miny, maxx, maxy
+
+
+def quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+# ----------------------------------------------------------------------------------------------------------------------
+# queries
+# ----------------------------------------------------------------------------------------------------------------------
+
+def query_features(
+        store: Path,
+        layer: str,
+        info: Dict[str, Any],
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+        stop_id: Optional[str] = None,
+        fields: Optional[List[str]] = None,
+        cursor: Optional[int] = None,
+        limit: int = 100,
+) -> Tuple[pd.DataFrame, Optional[int]]:
+    # fields have been checked against the layer schema, all other values are numbers or quoted
+    geometry_name = info["geometry_name"]
+    columns = ["t.fid", *(f't."{field}"' for field in (fields if fields is not None else info["fields"]))]
+    if geometry_name:
+        columns.append(f't."{geometry_name}"')
+
+    sql = f'SELECT {", ".join(columns)} FROM "{layer}" t'
+    conditions = []
+    if bbox is not None:
+        # the R-tree holds the feature envelopes, features are matched by bounding box
+        sql += f' JOIN "rtree_{layer}_{geometry_name}" r ON t.fid = r.id'
+        conditions.append("r.maxx >= {} AND r.minx <= {} AND r.maxy >= {} AND r.miny <= {}".format(*bbox))
+    if stop_id is not None:
+        conditions.append(f"t.stop_id = {quote(stop_id)}")
+    if cursor is not None:
+        conditions.append(f"t.fid > {int(cursor)}")
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY t.fid LIMIT {int(limit) + 1}"
+
+    df = pyogrio.read_dataframe(store, sql=sql, fid_as_index=True)
+    next_cursor = int(df.index[limit - 1]) if len(df) > limit else None
+    return df.iloc[:limit], next_cursor
+
+
+def feature_collection(df: pd.DataFrame, next_cursor: Optional[int]) -> Dict[str, Any]:
+    if isinstance(df, gpd.GeoDataFrame):
+        geometries = [feature["geometry"] for feature in json.loads(df.to_json(na="null"))["features"]]
+        df = pd.DataFrame(df.drop(columns=df.geometry.name))
+    else:
+        geometries = [None] * len(df)
+    records = json.loads(df.to_json(orient="records"))
+    features = [
+        {"type": "Feature", "id": int(fid), "properties": record, "geometry": geometry}
+        for fid, record, geometry in zip(df.index, records, geometries)
+    ]
+    return {
+        "type": "FeatureCollection",
+        "features": features,
+        "numberReturned": len(features),
+        "next_cursor": next_cursor,
+    }
@@ -0,0 +1,142 @@
+import bisect
+import math
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600, 10800)
+
+Labels = Tuple[str, ...]
+
+# ----------------------------------------------------------------------------------------------------------------------
+# metrics
+# ----------------------------------------------------------------------------------------------------------------------
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+class Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def label_values(self, labels: Dict[str, str]) -> Labels:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {', '.join(self.labelnames) or 'none'}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, Labels, Sequence[str], float]]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, values, labelnames, value in self.samples():
+            lines.append(f"{name}{format_labels(labelnames, values)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, self.labelnames, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    # values are read from a callback at scrape time, nothing is tracked in between
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], Optional[float]]):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def samples(self):
+        value = self.callback()
+        return [] if value is None else [(self.name, (), (), value)]
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Labels, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            # per bucket counts, the cumulative ones are only built when rendering
+            entry = self._values.setdefault(key, [[0] * (len(self.buckets) + 1), 0.0])
+            entry[0][i] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        samples = []
+        labelnames = (*self.labelnames, "le")
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, n in zip((*self.buckets, math.inf), counts):
+                cumulative += n
+                samples.append((f"{self.name}_bucket", (*key, format_value(bound)), labelnames, cumulative))
+            samples.append((f"{self.name}_sum", key, self.labelnames, total))
+            samples.append((f"{self.name}_count", key, self.labelnames, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric already registered: {metric.name}")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+# ----------------------------------------------------------------------------------------------------------------------
+# registry
+# ----------------------------------------------------------------------------------------------------------------------
+
+REGISTRY = Registry()
+
+JOB_DURATION = REGISTRY.register(Histogram("citwin_job_duration_seconds", "Run time of finished jobs", ["status"]))
+STEP_DURATION = REGISTRY.register(Histogram("citwin_step_duration_seconds", "Run time of completed pipeline steps", ["step"]))
+NETASCORE_DURATION = REGISTRY.register(Histogram("citwin_netascore_duration_seconds", "Run time of NetAScore subprocesses", ["status"]))
+UPLOAD_BYTES = REGISTRY.register(Counter("citwin_upload_bytes_total", "Bytes of uploaded files"))
+UPLOAD_SECONDS = REGISTRY.register(Counter("citwin_upload_seconds_total", "Time spent storing uploaded files, bytes over seconds is the throughput"))
+DOWNLOAD_BYTES = REGISTRY.register(Counter("citwin_download_bytes_total", "Bytes of served output files", ["encoding"]))
+
+
+def register_gauge(name: str, documentation: str, callback: Callable[[], Optional[float]]) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, callback))
@@ -0,0 +1,121 @@
+import queue
+import threading
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Dict, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+from pyogrio.errors import DataLayerError, DataSourceError
+
+# cost units roughly correspond to seconds of pipeline time on the production worker
+STOP_CLUSTER_COST = 0.01
+OD_ROW_COST = 0.01
+NETASCORE_EDGE_COST = 0.001
+NETASCORE_GENERATION_COST = 3600.0
+
+# ----------------------------------------------------------------------------------------------------------------------
+# cost estimation
+# ----------------------------------------------------------------------------------------------------------------------
+
+def feature_count(path: Path, layer: Optional[str] = None) -> int:
+    try:
+        if path.suffix.lower() == ".csv":
+            with open(path, "rb") as f:
+                lines = sum(chunk.count(b"\n") for chunk in iter(lambda: f.read(1024 * 1024), b""))
+            return max(lines - 1, 0)
+        if path.suffix.lower() == ".parquet":
+            return pq.ParquetFile(path).metadata.num_rows
+        return max(pyogrio.read_info(path, layer=layer, force_feature_count=True)["features"], 0)
+    except (DataLayerError, DataSourceError, pa.ArrowException, OSError):
+        raise ValueError(f"Unreadable input file: {path.name}{f', layer {layer}' if layer else ''}")
+
+
+def estimate_job_cost(od_clusters_a: Path, od_table: Path, stops: Path, netascore_gpkg: Optional[Path] = None, derived: bool = False) -> float:
+    # per-stop evaluation scales with the households around each stop, which scale with the origin clusters
+    cost = STOP_CLUSTER_COST * feature_count(stops) * max(feature_count(od_clusters_a), 1)
+    # derived jobs reuse the points, network and distances of their base job
+    if derived:
+        return round(cost, 1)
+    cost += OD_ROW_COST * feature_count(od_table)
+    if netascore_gpkg:
+        cost += NETASCORE_EDGE_COST * feature_count(netascore_gpkg, layer="edge")
+    else:
+        cost += NETASCORE_GENERATION_COST
+    return round(cost, 1)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# scheduler
+# ----------------------------------------------------------------------------------------------------------------------
+
+class JobPriority(str, Enum):
+    high = "high"
+    normal = "normal"
+    low = "low"
+
+
+PRIORITY_RANKS = {JobPriority.high: 0, JobPriority.normal: 1, JobPriority.low: 2}
+
+
+class JobScheduler:
+    # drop-in for queue.Queue: strict priority classes, fair share between tenants within a class,
+    # shortest estimated job first within a tenant, aged so that large jobs are not starved
+    def __init__(self, aging: float = 600.0):
+        self.aging = aging
+        self.entries: Dict[str, dict] = {}
+        self.usage: Dict[str, float] = {}
+        self.unfinished_tasks = 0
+        self._cond = threading.Condition()
+
+    def put(self, job_id: str, cost: float = 0.0, priority: JobPriority = JobPriority.normal, tenant: str = "default"):
+        with self._cond:
+            # tenants joining the queue start at the current minimum usage instead of their historic usage
+            active = {entry["tenant"] for entry in self.entries.values()}
+            floor = min((self.usage.get(t, 0.0) for t in active), default=0.0)
+            if tenant not in active:
+                self.usage[tenant] = max(self.usage.get(tenant, 0.0), floor)
+
+            self.entries[job_id] = {
+                "cost": cost,
+                "rank": PRIORITY_RANKS[JobPriority(priority)],
+                "tenant": tenant,
+                "enqueued": time.monotonic(),
+            }
+            self.unfinished_tasks += 1
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> str:
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.entries, timeout=timeout):
+                raise queue.Empty
+            job_id = self._select()
+            entry = self.entries.pop(job_id)
+            self.usage[entry["tenant"]] = self.usage.get(entry["tenant"], 0.0) + entry["cost"]
+            return job_id
+
+    def remove(self, job_id: str) -> bool:
+        with self._cond:
+            if self.entries.pop(job_id, None) is None:
+                return False
+            self.unfinished_tasks -= 1
+            return True
+
+    def task_done(self):
+        with self._cond:
+            self.unfinished_tasks -= 1
+
+    def qsize(self) -> int:
+        with self._cond:
+            return len(self.entries)
+
+    def _select(self) -> str:
+        now = time.monotonic()
+        rank = min(entry["rank"] for entry in self.entries.values())
+        candidates = {job_id: entry for job_id, entry in self.entries.items() if entry["rank"] == rank}
+        tenant = min({entry["tenant"] for entry in candidates.values()}, key=lambda t: self.usage.get(t, 0.0))
+        return min(
+            (job_id for job_id, entry in candidates.items() if entry["tenant"] == tenant),
+            key=lambda job_id: candidates[job_id]["cost"] / (1 + (now - candidates[job_id]["enqueued"]) / self.aging),
+        )
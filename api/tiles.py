@@ -0,0 +1,27 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+TILE_MEDIA_TYPE = "application/vnd.mapbox-vector-tile"
+
+
+class TileCache:
+    # encoded tiles by job, layer and tile address, least recently used tiles are dropped first
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self.tiles: OrderedDict[Hashable, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+            return tile
+
+    def put(self, key: Hashable, tile: bytes) -> None:
+        with self._lock:
+            self.tiles[key] = tile
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > self.max_size:
+                self.tiles.popitem(last=False)
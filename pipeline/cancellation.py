@@ -0,0 +1,40 @@
+import threading
+import time
+from typing import Optional
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class PipelineTimeout(PipelineCancelled):
+    pass
+
+
+class CancelToken:
+    def __init__(self, timeout: Optional[float] = None, parent: Optional["CancelToken"] = None):
+        self.timeout = timeout
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.parent = parent
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def raise_if_cancelled(self):
+        # a child token stops its own work without cancelling the parent
+        if self.parent is not None:
+            self.parent.raise_if_cancelled()
+        if self._event.is_set():
+            raise PipelineCancelled("Job cancelled")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise PipelineTimeout(f"Job exceeded timeout of {self.timeout:.0f} s")
+
+
+def check_cancelled(cancel_token: Optional[CancelToken]):
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
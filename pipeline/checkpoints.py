@@ -0,0 +1,123 @@
+import json
+import logging
+import os
+import pickle
+import shutil
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+from networkx import Graph
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTS_DIR = "checkpoints"
+MANIFEST_FILE = "manifest.json"
+
+# ----------------------------------------------------------------------------------------------------------------------
+# values
+# ----------------------------------------------------------------------------------------------------------------------
+
+def save_value(value: Any, directory: Path, name: str) -> Dict[str, Any]:
+    if isinstance(value, gpd.GeoSeries):
+        value = gpd.GeoDataFrame(geometry=value)
+        kind = "geoseries"
+    elif isinstance(value, gpd.GeoDataFrame):
+        kind = "geodataframe"
+    elif isinstance(value, pd.DataFrame):
+        kind = "dataframe"
+    elif isinstance(value, Graph):
+        path = directory / f"{name}.pickle"
+        with open(path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return {"kind": "graph", "file": path.name}
+    elif isinstance(value, Path):
+        return {"kind": "path", "value": str(value)}
+    elif isinstance(value, dict):
+        return {"kind": "paths", "value": {key: str(path) for key, path in value.items()}}
+    else:
+        return {"kind": "value", "value": value}
+
+    path = directory / f"{name}.parquet"
+    try:
+        value.to_parquet(path)
+    except (pa.ArrowException, TypeError, ValueError):
+        # mixed-type object columns have no parquet type
+        path = directory / f"{name}.pickle"
+        value.to_pickle(path)
+    return {"kind": kind, "file": path.name}
+
+
+def load_value(entry: Dict[str, Any], directory: Path) -> Any:
+    kind = entry["kind"]
+    if kind == "path":
+        return Path(entry["value"])
+    if kind == "paths":
+        return {key: Path(path) for key, path in entry["value"].items()}
+    if kind == "value":
+        return entry["value"]
+
+    path = directory / entry["file"]
+    if kind == "graph" or path.suffix == ".pickle":
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+    elif kind == "dataframe":
+        value = pd.read_parquet(path)
+    else:
+        value = gpd.read_parquet(path)
+    return value.geometry if kind == "geoseries" else value
+
+# ----------------------------------------------------------------------------------------------------------------------
+# checkpoints
+# ----------------------------------------------------------------------------------------------------------------------
+
+def save_checkpoint(directory: Path, values: Dict[str, Any]):
+    # written next to the final directory and renamed, a checkpoint is either complete or absent
+    tmp_dir = directory.with_name(f".tmp-{directory.name}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    manifest = {name: save_value(value, tmp_dir, name) for name, value in values.items()}
+    (tmp_dir / MANIFEST_FILE).write_text(json.dumps(manifest), encoding="utf-8")
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp_dir, directory)
+
+
+def load_checkpoint(directory: Path) -> Optional[Dict[str, Any]]:
+    manifest_path = directory / MANIFEST_FILE
+    if not manifest_path.exists():
+        return None
+    manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+
+    # paths recorded by a step, e.g. streamed outputs, must still exist
+    for entry in manifest.values():
+        files = [directory / entry["file"]] if "file" in entry else []
+        if entry["kind"] == "path":
+            files.append(Path(entry["value"]))
+        elif entry["kind"] == "paths":
+            files.extend(Path(path) for path in entry["value"].values())
+        if not all(path.exists() for path in files):
+            return None
+
+    return {name: load_value(entry, directory) for name, entry in manifest.items()}
+
+
+def find_checkpoint(job_dir: Path, step_name: str) -> Optional[Path]:
+    # step positions differ between plain and derived jobs, checkpoints are found by step name
+    return next(iter(sorted((job_dir / CHECKPOINTS_DIR).glob(f"*-{step_name}"))), None)
+
+
+def link_checkpoint(src: Path, dst: Path):
+    # checkpoint files are never modified after they are written, derived jobs share them through hard links
+    tmp_dir = dst.with_name(f".tmp-{dst.name}")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    for path in src.iterdir():
+        try:
+            os.link(path, tmp_dir / path.name)
+        except OSError:
+            shutil.copy2(path, tmp_dir / path.name)
+    os.replace(tmp_dir, dst)
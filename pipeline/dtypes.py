@@ -0,0 +1,76 @@
+from typing import Sequence, Union
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+
+ID_DTYPE = "int32"
+METRIC_DTYPE = "float32"
+# metrics are rounded to this many decimals before they are compacted
+METRIC_DECIMALS = 2
+
+ID_RANGE = np.iinfo(ID_DTYPE)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# ids
+# ----------------------------------------------------------------------------------------------------------------------
+
+def fits_id_dtype(values: pd.Series) -> bool:
+    return pd.api.types.is_integer_dtype(values) and (values.empty or (values.min() >= ID_RANGE.min and values.max() <= ID_RANGE.max))
+
+# ----------------------------------------------------------------------------------------------------------------------
+# frames
+# ----------------------------------------------------------------------------------------------------------------------
+
+def rounded_metric(values: pd.Series) -> pd.Series:
+    return np.round(values.astype("float64"), METRIC_DECIMALS)
+
+
+def same_values(a: pd.Series, b: pd.Series) -> bool:
+    return np.array_equal(a.to_numpy(), b.to_numpy(), equal_nan=True)
+
+
+def compact_frame(frame: Union[gpd.GeoDataFrame, pd.DataFrame], ids: Sequence[str] = (), categories: Sequence[str] = (), metrics: Sequence[str] = ()) -> Union[gpd.GeoDataFrame, pd.DataFrame]:
+    # generated ids and graph node ids are dense already, they keep their values; columns that do not fit keep their dtype
+    dtypes = {column: ID_DTYPE for column in ids if column in frame and fits_id_dtype(frame[column])}
+    dtypes.update({column: "category" for column in categories if column in frame})
+    dtypes.update({
+        column: METRIC_DTYPE for column in metrics
+        # float32 steps grow with the value, above 2**17 they are coarser than the rounded decimals
+        if column in frame and frame[column].dtype == "float64" and same_values(rounded_metric(frame[column].astype(METRIC_DTYPE)), frame[column])
+    })
+    return frame.astype(dtypes) if dtypes else frame
+
+
+def restore_frame(frame: Union[gpd.GeoDataFrame, pd.DataFrame], floats: bool = True) -> Union[gpd.GeoDataFrame, pd.DataFrame]:
+    # the values and field types of the ids and of the rounded metrics, as written before the frames were compacted
+    columns = {column: frame[column].to_numpy() for column in frame.columns if isinstance(frame[column].dtype, pd.CategoricalDtype)}
+    columns.update({column: frame[column].astype("int64") for column in frame.columns if frame[column].dtype == ID_DTYPE})
+    if floats:
+        # float32 columns that are not rounded metrics, e.g. read from the inputs, keep their values
+        metrics = [column for column in frame.columns if frame[column].dtype == METRIC_DTYPE]
+        restored = {column: rounded_metric(frame[column]) for column in metrics}
+        columns.update({column: values for column, values in restored.items() if same_values(values.astype(METRIC_DTYPE), frame[column])})
+    return frame.assign(**columns) if columns else frame
+
+
+def shortest_floats(values: pd.Series) -> np.ndarray:
+    # the fewest significant digits that give back the same float32, which is what its shortest representation holds
+    values = values.to_numpy(dtype=METRIC_DTYPE)
+    wide = values.astype("float64")
+    result = wide.copy()
+    finite = np.isfinite(wide) & (wide != 0)
+    magnitude = np.floor(np.log10(np.abs(wide, where=finite, out=np.ones_like(wide))))
+    # powers of ten up to 1e22 are exact, so are the candidates scaled by them
+    pending = finite & (magnitude >= -14) & (magnitude <= 22)
+    for digits in range(1, 10):
+        exponent = digits - 1 - magnitude
+        scale = 10.0 ** np.abs(exponent)
+        candidate = np.where(exponent >= 0, np.round(wide * scale) / scale, np.round(wide / scale) * scale)
+        done = pending & (candidate.astype(METRIC_DTYPE) == values)
+        result[done] = candidate[done]
+        pending &= ~done
+    # values beyond that range go through their string representation
+    rest = pending | (finite & ((magnitude < -14) | (magnitude > 22)))
+    result[rest] = values[rest].astype(str).astype("float64")
+    return result
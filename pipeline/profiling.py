@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_FILE = "profile.json"
+STACKS_DIR = "profile"
+RSS_INTERVAL = 0.1
+SAMPLING_INTERVAL = 0.01
+MAX_STACK_DEPTH = 64
+TOP_ALLOCATIONS = 10
+HOT_FUNCTIONS = 10
+
+_active = None
+
+# ----------------------------------------------------------------------------------------------------------------------
+# process
+# ----------------------------------------------------------------------------------------------------------------------
+
+def current_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def frame_stack(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{Path(code.co_filename).stem}:{code.co_qualname}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+# ----------------------------------------------------------------------------------------------------------------------
+# profiler
+# ----------------------------------------------------------------------------------------------------------------------
+
+class StepProfile:
+    def __init__(self, idx, name: str):
+        self.idx = idx
+        self.name = name
+        self.thread_id = threading.get_ident()
+        self.rss_start = current_rss()
+        self.peak_rss = self.rss_start
+        self.counters = Counter()
+        self.seconds = Counter()
+        self.stacks = Counter()
+        self.snapshot = None
+
+
+class Profiler:
+    # per-job timings, memory and counters, tracemalloc and stack sampling only when enabled as they slow the job down
+    def __init__(self, job_dir: Path, sampling: bool = False):
+        self.job_dir = job_dir
+        self.sampling = sampling
+        self.started_at = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        self.counters = Counter()
+        self.seconds = Counter()
+        self.steps = []
+        self._running = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started_tracemalloc = False
+        self._t0 = None
+        self._cpu0 = None
+
+    def __enter__(self):
+        global _active
+        self._t0 = time.perf_counter()
+        self._cpu0 = time.process_time()
+        if self.sampling and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        _active = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        global _active
+        _active = None
+        self._stop.set()
+        self._thread.join()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        self.write(error=None if exc is None else str(exc))
+
+    def _sample(self):
+        interval = SAMPLING_INTERVAL if self.sampling else RSS_INTERVAL
+        last_rss = 0.0
+        while not self._stop.wait(interval):
+            rss = None
+            if time.perf_counter() - last_rss >= RSS_INTERVAL:
+                last_rss = time.perf_counter()
+                rss = current_rss()
+            frames = sys._current_frames() if self.sampling else {}
+
+            # under the lock, a finished step is no longer updated while its result is built
+            with self._lock:
+                for step in self._running.values():
+                    if rss is not None and (step.peak_rss is None or rss > step.peak_rss):
+                        step.peak_rss = rss
+                    frame = frames.get(step.thread_id)
+                    if frame is not None:
+                        step.stacks[frame_stack(frame)] += 1
+            del frames
+
+    @contextmanager
+    def step(self, idx, name: str):
+        step = StepProfile(idx, name)
+        if self.sampling:
+            step.snapshot = tracemalloc.take_snapshot()
+        t0 = time.perf_counter()
+        cpu0 = time.thread_time()
+        with self._lock:
+            self._running[step.thread_id] = step
+        self._local.step = step
+        try:
+            yield step
+        finally:
+            self._local.step = None
+            with self._lock:
+                self._running.pop(step.thread_id, None)
+            result = self.step_result(step, time.perf_counter() - t0, time.thread_time() - cpu0)
+            with self._lock:
+                self.steps.append(result)
+            self.write()
+
+    def step_result(self, step: StepProfile, wall: float, cpu: float) -> Dict[str, Any]:
+        # cpu time of the step's own thread, work in its thread or process pools shows up only in the job total
+        result = {
+            "idx": step.idx,
+            "name": step.name,
+            "wall_s": round(wall, 3),
+            "cpu_s": round(cpu, 3),
+            "rss_start_bytes": step.rss_start,
+            "rss_end_bytes": current_rss(),
+            "peak_rss_bytes": step.peak_rss,
+            "counters": counters_to_json(step.counters, step.seconds),
+        }
+        if step.snapshot is not None:
+            # tracemalloc traces the whole process, concurrent steps share their allocations
+            stats = tracemalloc.take_snapshot().compare_to(step.snapshot, "lineno")
+            result["top_allocations"] = [
+                {"location": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}", "size_bytes": stat.size_diff, "count": stat.count_diff}
+                for stat in sorted(stats, key=lambda stat: stat.size_diff, reverse=True)[:TOP_ALLOCATIONS]
+            ]
+            step.snapshot = None
+        if self.sampling:
+            result["samples"] = sum(step.stacks.values())
+            result["hot_functions"] = hot_functions(step.stacks)
+            result["stacks"] = self.write_stacks(step)
+        return result
+
+    def count(self, name: str, n: int = 1, seconds: float = 0.0):
+        step = getattr(self._local, "step", None)
+        with self._lock:
+            self.counters[name] += n
+            self.seconds[name] += seconds
+            if step is not None:
+                step.counters[name] += n
+                step.seconds[name] += seconds
+
+    def write_stacks(self, step: StepProfile) -> Optional[str]:
+        # collapsed stacks, one "frame;frame;frame count" line each, as read by flame graph tools
+        if not step.stacks:
+            return None
+        path = self.job_dir / STACKS_DIR / f"{step.idx}-{step.name}.folded"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text("".join(f"{stack} {n}\n" for stack, n in step.stacks.most_common()), encoding="utf-8")
+        return str(path.relative_to(self.job_dir))
+
+    def write(self, error: Optional[str] = None):
+        with self._lock:
+            profile = {
+                "started_at": self.started_at,
+                "wall_s": round(time.perf_counter() - self._t0, 3),
+                "cpu_s": round(time.process_time() - self._cpu0, 3),
+                "peak_rss_bytes": max((step["peak_rss_bytes"] or 0 for step in self.steps), default=None),
+                "process_peak_rss_bytes": peak_rss(),
+                "sampling": self.sampling,
+                "error": error,
+                "steps": sorted(self.steps, key=lambda step: step["idx"]),
+                "counters": counters_to_json(self.counters, self.seconds),
+            }
+        path = self.job_dir / PROFILE_FILE
+        tmp_path = path.with_name(f".tmp-{path.name}")
+        try:
+            tmp_path.write_text(json.dumps(profile, separators=(",", ":")), encoding="utf-8")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # a job whose directory is gone has nothing left to profile
+            logger.warning(f"– profile not written: {e}")
+
+
+def counters_to_json(counters: Counter, seconds: Counter) -> Dict[str, Any]:
+    return {name: {"count": n, "seconds": round(seconds[name], 3)} for name, n in sorted(counters.items())}
+
+
+def hot_functions(stacks: Counter) -> list:
+    # samples with the function at the top of the stack, i.e. time spent in its own code
+    leaves = Counter()
+    for stack, n in stacks.items():
+        leaves[stack.rsplit(";", 1)[-1]] += n
+    total = sum(leaves.values())
+    return [{"function": name, "samples": n, "share": round(n / total, 3)} for name, n in leaves.most_common(HOT_FUNCTIONS)]
+
+# ----------------------------------------------------------------------------------------------------------------------
+# counters
+# ----------------------------------------------------------------------------------------------------------------------
+
+def count(name: str, n: int = 1, seconds: float = 0.0):
+    profiler = _active
+    if profiler is not None:
+        profiler.count(name, n, seconds)
+
+
+@contextmanager
+def timed(name: str, n: int = 1):
+    if _active is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        count(name, n, time.perf_counter() - t0)
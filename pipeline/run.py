@@ -1,27 +1,65 @@
+import gc
 import logging
 import shutil
 import time
 import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Callable, Optional, Dict, List, Sequence, Tuple
 
 import geopandas as gpd
 import pandas as pd
 from networkx import Graph
 
+from api.metrics import STEP_DURATION
 from api.paths import JOBS_DIR, NETASCORE_DIR, NETASCORE_PROFILE_BIKE, NETASCORE_PROFILE_WALK, NETASCORE_SETTINGS
+from pipeline.cancellation import CancelToken, check_cancelled
+from pipeline.checkpoints import CHECKPOINTS_DIR, find_checkpoint, link_checkpoint, load_checkpoint, save_checkpoint
+from pipeline.profiling import Profiler
+from pipeline.spill import SPILL_DIR, load_frame, spill_frame, spillable
 from pipeline.steps.build_graphs import build_graph, build_graph_quality
+from pipeline.steps.derive_results import combine_stop_rows, missing_base_fields, order_stops, unchanged_stop_ids
 from pipeline.steps.disaggregate_data import distribute_points_in_raster, disaggregate_table_to_edges
+from pipeline.steps.edge_flows import FLOW_AGGREGATIONS, EdgeFlowAccumulator
 from pipeline.steps.evaluate_stops import evaluate_accessibility
+from pipeline.steps.export_results import DEFAULT_LAYERS, LAYERS, OUTPUT_FORMATS, STREAMABLE_LAYERS, compress_outputs, export_layers, feature_store_path, index_feature_store, open_feature_writers, write_feature_store
 from pipeline.steps.filter_network import add_network_distance
-from pipeline.steps.handle_data import calculate_distance, ensure_wgs84, get_utm_srid, compute_bbox_str, filter_gdf
+from pipeline.steps.handle_data import calculate_distance, ensure_wgs84, get_utm_srid, compute_bbox_str, filter_gdf, read_gdf
 from pipeline.steps.generate_netascore import update_settings, run_netascore
+from pipeline.steps.normalize_results import household_points, link_households, normalize_edges
+from pipeline.steps.replicates import REPLICATE_COLUMNS, draw_replicates, replicate_ratios, replicate_seeds, summarize_ratios
 from pipeline.steps.snap_points import build_balltree, snap_with_balltree
+from pipeline.steps.summarize_results import SUMMARY_FILE, summarize_stops, write_summary
+from pipeline.steps.sweep_thresholds import sweep_stops
+from pipeline.steps.vector_tiles import MAX_ZOOM, TILES_DIR, seed_tiles
+from pipeline.tracing import TRACES_FILE, Tracer
 
-DISTANCE_THRESHOLD = calculate_distance(15, 15)
+DISTANCE_TIME_BUDGET = 15
+DISTANCE_THRESHOLD = calculate_distance(15, DISTANCE_TIME_BUDGET)
 INDEX_THRESHOLD = 0.5
 
+# context field of each output layer
+LAYER_FRAMES = {
+    "od_points_a": "od_points_a_gdf",
+    "od_points_b": "od_points_b_gdf",
+    "od_edges": "od_edges_gdf",
+    "edges_base": "edges_base_gdf",
+    "edges_quality": "edges_quality_gdf",
+    "routes_base": "routes_base_gdf",
+    "routes_quality": "routes_quality_gdf",
+    "stops_updated": "stops_updated_gdf",
+    "households": "households_gdf",
+    "edges": "edges_gdf",
+    "stop_edges": "stop_edges_df",
+    "household_points": "household_points_gdf",
+    "stop_households": "stop_households_df",
+    "edge_flows_base": "edge_flows_base_gdf",
+    "edge_flows_quality": "edge_flows_quality_gdf",
+    "stops_sweep": "stops_sweep_df",
+}
+
 logger = logging.getLogger(__name__)
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -51,8 +89,21 @@ class PipelineContext:
     job_id: str
     job_dir: Path
     output_format: str
+    layers: Optional[List[str]] = None
     seed: Optional[int] = None
+    streaming: bool = False
+    flow_aggregation: str = "overall"
+    coordinate_precision: Optional[int] = None
+    downcast_floats: bool = False
+    feature_store: bool = True
+    tile_seed_max_zoom: Optional[int] = None
     generated_netascore: bool = False
+    base_evaluation: Optional[Path] = None
+    step: Optional[str] = None
+    progress_callback: Optional[Callable] = None
+    cancel_token: Optional[CancelToken] = None
+    profiler: Optional[Profiler] = None
+    tracer: Optional[Tracer] = None
 
     od_clusters_a_gdf: Optional[gpd.GeoDataFrame] = None
     od_clusters_b_gdf: Optional[gpd.GeoDataFrame] = None
@@ -79,22 +130,53 @@ class PipelineContext:
     edges_quality_gdf: Optional[gpd.GeoDataFrame] = None
     routes_base_gdf: Optional[gpd.GeoDataFrame] = None
     routes_quality_gdf: Optional[gpd.GeoDataFrame] = None
+    stops_updated_gdf: Optional[gpd.GeoDataFrame] = None
     households_gdf: Optional[gpd.GeoDataFrame] = None
+    stop_edges_base_df: Optional[pd.DataFrame] = None
+    stop_edges_quality_df: Optional[pd.DataFrame] = None
+    edges_gdf: Optional[gpd.GeoDataFrame] = None
+    stop_edges_df: Optional[pd.DataFrame] = None
+    household_points_gdf: Optional[gpd.GeoDataFrame] = None
+    stop_households_df: Optional[pd.DataFrame] = None
+    edge_flows_base_gdf: Optional[gpd.GeoDataFrame] = None
+    edge_flows_quality_gdf: Optional[gpd.GeoDataFrame] = None
+    stops_sweep_df: Optional[pd.DataFrame] = None
+    streamed_outputs: Optional[Dict[str, Path]] = None
     outputs: Optional[Dict[str, Path]] = None
 
+    def report_progress(self, done: int, total: int):
+        if self.progress_callback:
+            self.progress_callback(self.step, f"{done}/{total}")
+
+
+def in_job_dir(ctx: PipelineContext, path: Path) -> bool:
+    # inputs linked from the dataset registry, their parsed forms are cached next to them
+    return path.parent == ctx.job_dir
+
 # ----------------------------------------------------------------------------------------------------------------------
 # base class for pipeline step
 # ----------------------------------------------------------------------------------------------------------------------
 
 class PipelineStep:
+    # context fields the step reads and writes, they decide which steps can run concurrently
+    reads: Tuple[str, ...] = ()
+    writes: Tuple[str, ...] = ()
+
     def run(self, ctx):
         raise NotImplementedError()
 
     def __call__(self, ctx, idx=None, total=None):
+        check_cancelled(ctx.cancel_token)
         logger.info(f"◯ [{idx}/{total}] {self.__class__.__name__}")
         t0 = time.time()
-        result = self.run(ctx)
+        with (
+            ctx.tracer.span(self.__class__.__name__, step=idx) if ctx.tracer else nullcontext(),
+            ctx.profiler.step(idx, self.__class__.__name__) if ctx.profiler else nullcontext(),
+        ):
+            result = self.run(ctx)
+        check_cancelled(ctx.cancel_token)
         t1 = time.time()
+        STEP_DURATION.observe(t1 - t0, step=self.__class__.__name__)
         logger.info(f"● [{idx}/{total}] {self.__class__.__name__} ({t1 - t0:.1f} s)")
         return result
 
@@ -103,6 +185,8 @@ class PipelineStep:
 # ----------------------------------------------------------------------------------------------------------------------
 
 class HandleDataStep(PipelineStep):
+    writes = ("od_clusters_a_gdf", "od_clusters_b_gdf", "od_table_df", "stops_gdf", "stops_buffer_gdf", "bbox_str", "target_srid")
+
     def __init__(self, od_clusters_a, od_clusters_b, od_table, stops):
         self.od_clusters_a = od_clusters_a
         self.od_clusters_b = od_clusters_b
@@ -110,10 +194,10 @@ class HandleDataStep(PipelineStep):
         self.stops = stops
 
     def run(self, ctx):
-        ctx.od_clusters_a_gdf = ensure_wgs84(gpd.read_file(self.od_clusters_a))
-        ctx.od_clusters_b_gdf = ensure_wgs84(gpd.read_file(self.od_clusters_b))
+        ctx.od_clusters_a_gdf = ensure_wgs84(read_gdf(self.od_clusters_a, cache=in_job_dir(ctx, self.od_clusters_a)))
+        ctx.od_clusters_b_gdf = ensure_wgs84(read_gdf(self.od_clusters_b, cache=in_job_dir(ctx, self.od_clusters_b)))
         ctx.od_table_df = pd.read_csv(self.od_table, delimiter=";")
-        ctx.stops_gdf = ensure_wgs84(gpd.read_file(self.stops))
+        ctx.stops_gdf = ensure_wgs84(read_gdf(self.stops, cache=in_job_dir(ctx, self.stops)))
 
         ctx.target_srid = get_utm_srid(ctx.stops_gdf)
         logger.info(f"– target_srid: {ctx.target_srid}")
@@ -127,6 +211,9 @@ class HandleDataStep(PipelineStep):
 
 
 class DisaggregateDataStep(PipelineStep):
+    reads = ("od_clusters_a_gdf", "od_clusters_b_gdf", "od_table_df")
+    writes = ("od_points_a_gdf", "od_points_b_gdf", "od_edges_gdf")
+
     def __init__(self, fields):
         self.fields = fields
 
@@ -142,6 +229,9 @@ class DisaggregateDataStep(PipelineStep):
 
 
 class GenerateNetascoreStep(PipelineStep):
+    reads = ("target_srid", "bbox_str", "netascore_gpkg")
+    writes = ("netascore_gpkg", "generated_netascore", "netascore_edges_gdf", "netascore_nodes_gdf")
+
     def run(self, ctx):
         if ctx.netascore_gpkg is None:
             case_id = "default_case"
@@ -155,17 +245,24 @@ class GenerateNetascoreStep(PipelineStep):
                             case_id)
 
             logger.info("– run netascore")
-            run_netascore(NETASCORE_DIR, netascore_data_dir / "settings.yml")
-            ctx.netascore_gpkg = ctx.job_dir / "netascore.gpkg"
-            shutil.copy(netascore_data_dir / f"netascore_{case_id}.gpkg", ctx.netascore_gpkg)
-            shutil.rmtree(netascore_data_dir, ignore_errors=True)
+            try:
+                run_netascore(NETASCORE_DIR, netascore_data_dir / "settings.yml", ctx.cancel_token, ctx.tracer)
+                ctx.netascore_gpkg = ctx.job_dir / "netascore.gpkg"
+                shutil.copy(netascore_data_dir / f"netascore_{case_id}.gpkg", ctx.netascore_gpkg)
+            finally:
+                shutil.rmtree(netascore_data_dir, ignore_errors=True)
             ctx.generated_netascore = True
 
-        ctx.netascore_edges_gdf = ensure_wgs84(gpd.read_file(ctx.netascore_gpkg, layer="edge"))
-        ctx.netascore_nodes_gdf = ensure_wgs84(gpd.read_file(ctx.netascore_gpkg, layer="node"))
+        # a generated network is not a registered dataset, its parsed form would never be reused
+        cache = not ctx.generated_netascore and in_job_dir(ctx, ctx.netascore_gpkg)
+        ctx.netascore_edges_gdf = ensure_wgs84(read_gdf(ctx.netascore_gpkg, layer="edge", cache=cache))
+        ctx.netascore_nodes_gdf = ensure_wgs84(read_gdf(ctx.netascore_gpkg, layer="node", cache=cache))
 
 
 class BuildGraphsStep(PipelineStep):
+    reads = ("netascore_edges_gdf", "netascore_nodes_gdf")
+    writes = ("G_base", "G_base_reversed", "G_quality", "G_quality_reversed")
+
     def run(self, ctx):
         graph_nodes_gdf = ctx.netascore_nodes_gdf.reset_index().rename(columns={'index': 'node_id'})
         graph_nodes_gdf['node_id'] = graph_nodes_gdf['node_id'] + 1
@@ -180,6 +277,9 @@ class BuildGraphsStep(PipelineStep):
 
 
 class SnapPointsStep(PipelineStep):
+    reads = ("G_base", "G_quality", "od_points_a_gdf", "od_points_b_gdf", "stops_gdf")
+    writes = ("od_points_a_gdf", "od_points_b_gdf", "stops_gdf")
+
     def run(self, ctx):
         logger.info("– building balltree on graph nodes")
         balltree_base, node_ids_base = build_balltree(ctx.G_base)
@@ -192,10 +292,39 @@ class SnapPointsStep(PipelineStep):
         ctx.stops_gdf = snap_with_balltree(ctx.stops_gdf, balltree_quality, node_ids_quality, "node_id_quality")
 
 
+class UpdateStopsStep(PipelineStep):
+    # derived jobs: replaces the base job's stops, everything else is restored from its checkpoints
+    reads = ("G_base", "G_quality", "stops_buffer_gdf", "target_srid")
+    writes = ("stops_gdf",)
+
+    def __init__(self, stops, stops_id_field):
+        self.stops = stops
+        self.stops_id_field = stops_id_field
+
+    def run(self, ctx):
+        stops_gdf = ensure_wgs84(read_gdf(self.stops, cache=in_job_dir(ctx, self.stops)))
+
+        # households and network were clipped to the base job's stops, new catchments must lie within them
+        area = ctx.stops_buffer_gdf.to_crs(epsg=ctx.target_srid).union_all()
+        catchments = stops_gdf.to_crs(epsg=ctx.target_srid).geometry.buffer(DISTANCE_THRESHOLD)
+        outside = stops_gdf.loc[~catchments.within(area), self.stops_id_field].tolist()
+        if outside:
+            raise ValueError(f"Stops outside the area of the base job: {', '.join(map(str, outside))}")
+
+        logger.info("– snapping stops to graph nodes")
+        balltree_base, node_ids_base = build_balltree(ctx.G_base)
+        balltree_quality, node_ids_quality = build_balltree(ctx.G_quality)
+        stops_gdf = snap_with_balltree(stops_gdf, balltree_base, node_ids_base, "node_id_base")
+        ctx.stops_gdf = snap_with_balltree(stops_gdf, balltree_quality, node_ids_quality, "node_id_quality")
+
+
 class FilterNetworkStep(PipelineStep):
+    reads = ("od_edges_gdf", "od_points_a_gdf", "od_points_b_gdf", "G_base")
+    writes = ("od_edges_gdf", "od_points_a_gdf", "od_points_b_gdf")
+
     def run(self, ctx):
         logger.info("– adding network distance")
-        ctx.od_edges_gdf = add_network_distance(ctx.od_edges_gdf, ctx.od_points_a_gdf, ctx.od_points_b_gdf, ctx.G_base)
+        ctx.od_edges_gdf = add_network_distance(ctx.od_edges_gdf, ctx.od_points_a_gdf, ctx.od_points_b_gdf, ctx.G_base, ctx.report_progress, ctx.cancel_token)
 
         logger.info(f"– removing edges and points with distance > {DISTANCE_THRESHOLD} m")
         ctx.od_edges_gdf = ctx.od_edges_gdf[ctx.od_edges_gdf["distance"] <= DISTANCE_THRESHOLD]
@@ -205,52 +334,372 @@ class FilterNetworkStep(PipelineStep):
         ctx.od_points_b_gdf = ctx.od_points_b_gdf[ctx.od_points_b_gdf["point_id"].isin(valid_b_ids)]
 
 
+class SweepThresholdsStep(PipelineStep):
+    reads = ("G_base", "stops_gdf", "od_points_a_gdf")
+    writes = ("stops_sweep_df",)
+
+    def __init__(self, stops_id_field, time_budgets, index_thresholds):
+        self.stops_id_field = stops_id_field
+        self.time_budgets = time_budgets
+        self.index_thresholds = index_thresholds
+
+    def run(self, ctx):
+        logger.info(f"– time budgets: {self.time_budgets} min, index thresholds: {self.index_thresholds}")
+        ctx.stops_sweep_df = sweep_stops(
+            ctx.stops_gdf, ctx.od_points_a_gdf, self.stops_id_field, ctx.G_base, self.time_budgets, self.index_thresholds,
+            progress_callback=ctx.report_progress, cancel_token=ctx.cancel_token
+        )
+
+
 class EvaluateStopsStep(PipelineStep):
+    reads = (
+        "netascore_edges_gdf", "stops_gdf", "od_points_a_gdf",
+        "G_base", "G_quality", "G_base_reversed", "G_quality_reversed",
+    )
+    writes = (
+        "routes_base_gdf", "routes_quality_gdf", "stops_updated_gdf", "households_gdf", "streamed_outputs",
+        "stop_edges_base_df", "stop_edges_quality_df",
+        "edges_base_gdf", "edges_quality_gdf", "edges_gdf", "stop_edges_df", "household_points_gdf",
+        "stop_households_df", "edge_flows_base_gdf", "edge_flows_quality_gdf",
+    )
+
     def __init__(self, stops_id_field):
         self.stops_id_field = stops_id_field
 
     def run(self, ctx):
-        ctx.edges_base_gdf, ctx.edges_quality_gdf, ctx.routes_base_gdf, ctx.routes_quality_gdf, ctx.stops_gdf, ctx.households_gdf = evaluate_accessibility(
-            ctx.netascore_edges_gdf, ctx.stops_gdf, ctx.od_points_a_gdf, self.stops_id_field, ctx.G_base, ctx.G_quality,
-            ctx.G_base_reversed, ctx.G_quality_reversed, DISTANCE_THRESHOLD
+        layers = set(ctx.layers)
+        generate_graphs = bool({"edges_base", "edges_quality", "edges", "stop_edges"} & layers)
+        generate_routes = bool({"routes_base", "routes_quality"} & layers)
+
+        by_stop = ctx.flow_aggregation == "stop"
+        flows_base = EdgeFlowAccumulator(ctx.G_base, by_stop=by_stop) if "edge_flows_base" in layers else None
+        flows_quality = EdgeFlowAccumulator(ctx.G_quality, by_stop=by_stop) if "edge_flows_quality" in layers else None
+
+        # derived jobs copy the rows of stops that were neither added nor moved from the base job
+        base, unchanged = None, set()
+        stops_gdf = ctx.stops_gdf
+        if ctx.base_evaluation is not None:
+            base = load_checkpoint(ctx.base_evaluation)
+            missing = missing_base_fields(base, ["stops_updated", *ctx.layers]) if base is not None else ["checkpoint"]
+            if missing:
+                logger.info(f"– evaluating all stops, base job lacks: {', '.join(missing)}")
+                base = None
+            else:
+                # replicate statistics of the base job do not apply to the derived job's stop set
+                base["stops_updated_gdf"] = base["stops_updated_gdf"].drop(columns=REPLICATE_COLUMNS, errors="ignore")
+                unchanged = unchanged_stop_ids(ctx.stops_gdf, base["stops_updated_gdf"], self.stops_id_field)
+                stops_gdf = ctx.stops_gdf[~ctx.stops_gdf[self.stops_id_field].isin(unchanged)]
+                logger.info(f"– evaluating {len(stops_gdf)} added or moved stops, copying {len(unchanged)} from base job")
+
+        sinks = None
+        if ctx.streaming:
+            streamed_layers = [layer for layer in STREAMABLE_LAYERS if layer in ctx.layers]
+            logger.info(f"– streaming layers: {', '.join(streamed_layers) or 'none'}")
+            sinks = open_feature_writers(
+                streamed_layers, ctx.job_dir, ctx.output_format, ctx.netascore_edges_gdf.crs, feature_store=ctx.feature_store,
+                coordinate_precision=ctx.coordinate_precision, downcast_floats=ctx.downcast_floats
+            )
+
+        try:
+            if len(stops_gdf) or base is None:
+                stop_edges_base, stop_edges_quality, routes_base, routes_quality, stops, households = evaluate_accessibility(
+                    ctx.netascore_edges_gdf, stops_gdf, ctx.od_points_a_gdf, self.stops_id_field, ctx.G_base, ctx.G_quality,
+                    ctx.G_base_reversed, ctx.G_quality_reversed, DISTANCE_THRESHOLD, generate_graphs=generate_graphs,
+                    generate_routes=generate_routes, progress_callback=ctx.report_progress, cancel_token=ctx.cancel_token,
+                    sinks=sinks, flows_base=flows_base, flows_quality=flows_quality
+                )
+            else:
+                stop_edges_base, stop_edges_quality, routes_base, routes_quality, stops, households = (
+                    None if base[name] is None else base[name].iloc[:0] for name in (
+                        "stop_edges_base_df", "stop_edges_quality_df", "routes_base_gdf", "routes_quality_gdf", "stops_updated_gdf", "households_gdf"
+                    )
+                )
+
+            # layers that were not requested come back as empty lists
+            if not generate_graphs:
+                stop_edges_base = stop_edges_quality = None
+            if not generate_routes:
+                routes_base = routes_quality = None
+
+            if base is not None:
+                for layer in (sinks or {}).keys() & {"households", "stop_households", "routes_base", "routes_quality"}:
+                    frame = base["households_gdf" if layer == "stop_households" else f"{layer}_gdf"]
+                    frame = frame[frame["stop_id"].isin(unchanged)]
+                    sinks[layer].write(link_households(frame) if layer == "stop_households" else frame)
+                stop_edges_base = combine_stop_rows(base["stop_edges_base_df"], stop_edges_base, unchanged)
+                stop_edges_quality = combine_stop_rows(base["stop_edges_quality_df"], stop_edges_quality, unchanged)
+                routes_base = combine_stop_rows(base["routes_base_gdf"], routes_base, unchanged)
+                routes_quality = combine_stop_rows(base["routes_quality_gdf"], routes_quality, unchanged)
+                households = combine_stop_rows(base["households_gdf"], households, unchanged)
+                stops = order_stops(combine_stop_rows(base["stops_updated_gdf"], stops, unchanged), ctx.stops_gdf[self.stops_id_field].tolist())
+        except BaseException:
+            for sink in (sinks or {}).values():
+                sink.abort()
+            raise
+
+        if sinks is not None:
+            for sink in sinks.values():
+                sink.close()
+            ctx.streamed_outputs = {layer: sink.path for layer, sink in sinks.items()}
+
+        ctx.stop_edges_base_df, ctx.stop_edges_quality_df = stop_edges_base, stop_edges_quality
+        ctx.routes_base_gdf, ctx.routes_quality_gdf = routes_base, routes_quality
+        ctx.stops_updated_gdf, ctx.households_gdf = stops, households
+
+        if "edges_base" in layers:
+            ctx.edges_base_gdf = ctx.netascore_edges_gdf.merge(stop_edges_base, on="osm_id")
+        if "edges_quality" in layers:
+            ctx.edges_quality_gdf = ctx.netascore_edges_gdf.merge(stop_edges_quality, on="osm_id")
+        if {"edges", "stop_edges"} & layers:
+            ctx.edges_gdf, ctx.stop_edges_df = normalize_edges(ctx.netascore_edges_gdf, stop_edges_base, stop_edges_quality)
+        if "household_points" in layers:
+            ctx.household_points_gdf = household_points(ctx.od_points_a_gdf)
+        if "stop_households" in layers and ctx.households_gdf is not None:
+            ctx.stop_households_df = link_households(ctx.households_gdf)
+        if flows_base is not None:
+            ctx.edge_flows_base_gdf = flows_base.to_gdf(ctx.netascore_edges_gdf.crs)
+        if flows_quality is not None:
+            ctx.edge_flows_quality_gdf = flows_quality.to_gdf(ctx.netascore_edges_gdf.crs)
+        if base is not None:
+            ctx.edge_flows_base_gdf = combine_stop_rows(base["edge_flows_base_gdf"], ctx.edge_flows_base_gdf, unchanged)
+            ctx.edge_flows_quality_gdf = combine_stop_rows(base["edge_flows_quality_gdf"], ctx.edge_flows_quality_gdf, unchanged)
+
+
+class ReplicatesStep(PipelineStep):
+    # the main run is the first replicate, further household draws only repeat the steps that depend on the seed
+    reads = ("od_clusters_a_gdf", "od_clusters_b_gdf", "od_table_df", "od_points_a_gdf", "G_base", "stops_updated_gdf")
+    writes = ("stops_updated_gdf",)
+
+    def __init__(self, fields, replicates):
+        self.fields = fields
+        self.replicates = replicates
+
+    def run(self, ctx):
+        seeds = replicate_seeds(ctx.seed, self.replicates - 1)
+        logger.info(f"– drawing {len(seeds)} household replicates")
+        draws = draw_replicates(
+            seeds, ctx.G_base, ctx.od_clusters_a_gdf, ctx.od_clusters_b_gdf, ctx.od_table_df, self.fields, DISTANCE_THRESHOLD,
+            progress_callback=ctx.report_progress, cancel_token=ctx.cancel_token
         )
 
+        logger.info("– evaluating replicates")
+        ratios = replicate_ratios(ctx.stops_updated_gdf, [ctx.od_points_a_gdf['node_id'], *draws], ctx.G_base, DISTANCE_THRESHOLD, INDEX_THRESHOLD, ctx.cancel_token)
+        ctx.stops_updated_gdf = pd.concat([ctx.stops_updated_gdf.reset_index(drop=True), summarize_ratios(ratios)], axis=1)
+
 
 class ExportResultsStep(PipelineStep):
+    reads = (*LAYER_FRAMES.values(), "streamed_outputs", "generated_netascore", "netascore_gpkg")
+    writes = ("outputs",)
+
+    def __init__(self, layers: Optional[List[str]] = None):
+        # frames of layers that are not exported can be released before the export
+        if layers is not None:
+            frames = dict.fromkeys([*(LAYER_FRAMES[layer] for layer in layers), "stops_updated_gdf"])
+            self.reads = (*frames, "streamed_outputs", "generated_netascore", "netascore_gpkg")
+
     def run(self, ctx):
-        extension = {"GeoJSON": "geojson", "GPKG": "gpkg"}[ctx.output_format]
-        driver = {"GeoJSON": "GeoJSON", "GPKG": "GPKG"}[ctx.output_format]
-
-        od_points_a = ctx.job_dir / f"od_points_a.{extension}"
-        od_points_b = ctx.job_dir / f"od_points_b.{extension}"
-        od_edges = ctx.job_dir / f"od_edges.{extension}"
-        edges_base = ctx.job_dir / f"edges_base.{extension}"
-        edges_quality = ctx.job_dir / f"edges_quality.{extension}"
-        routes_base = ctx.job_dir / f"routes_base.{extension}"
-        routes_quality = ctx.job_dir / f"routes_quality.{extension}"
-        stops_updated = ctx.job_dir / f"stops_updated.{extension}"
-        households = ctx.job_dir / f"households.{extension}"
-
-        ctx.od_points_a_gdf.to_file(od_points_a, driver=driver)
-        ctx.od_points_b_gdf.to_file(od_points_b, driver=driver)
-        ctx.od_edges_gdf.to_file(od_edges, driver=driver)
-        ctx.edges_base_gdf.to_file(edges_base, driver=driver)
-        ctx.edges_quality_gdf.to_file(edges_quality, driver=driver)
-        ctx.routes_base_gdf.to_file(routes_base, driver=driver)
-        ctx.routes_quality_gdf.to_file(routes_quality, driver=driver)
-        ctx.stops_gdf.to_file(stops_updated, driver=driver)
-        ctx.households_gdf.to_file(households, driver=driver)
-
-        outputs = {
-            "stops_updated": stops_updated,
-            "households": households
-        }
+        frames = {layer: getattr(ctx, name) for layer, name in LAYER_FRAMES.items() if name in self.reads}
+
+        streamed_outputs = ctx.streamed_outputs or {}
+        remaining_layers = [layer for layer in ctx.layers if layer not in streamed_outputs]
+
+        logger.info(f"– writing layers: {', '.join(remaining_layers)}")
+        outputs = {**streamed_outputs, **export_layers(
+            {layer: frames[layer] for layer in remaining_layers}, ctx.job_dir, ctx.output_format,
+            coordinate_precision=ctx.coordinate_precision, downcast_floats=ctx.downcast_floats
+        )}
+        outputs = {layer: outputs[layer] for layer in ctx.layers}
+
+        if ctx.feature_store:
+            store = feature_store_path(ctx.job_dir, ctx.output_format)
+            if ctx.output_format != "GPKG":
+                logger.info(f"– writing feature store: {store.name}")
+                write_feature_store(
+                    {layer: frames[layer] for layer in remaining_layers}, store,
+                    coordinate_precision=ctx.coordinate_precision, downcast_floats=ctx.downcast_floats
+                )
+            if store.exists():
+                index_feature_store(store)
+
+                # low zooms cover the most features per tile and are the slowest to render on demand
+                if ctx.tile_seed_max_zoom is not None:
+                    count = seed_tiles(store, ctx.layers, ctx.job_dir / TILES_DIR, ctx.tile_seed_max_zoom)
+                    logger.info(f"– seeded {count} tiles up to zoom {ctx.tile_seed_max_zoom}")
+
+        logger.info(f"– writing summary: {SUMMARY_FILE}")
+        outputs["summary"] = write_summary(summarize_stops(ctx.stops_updated_gdf), ctx.job_dir / SUMMARY_FILE)
 
         if ctx.generated_netascore:
             outputs["netascore_gpkg"] = ctx.netascore_gpkg
 
+        logger.info("– compressing outputs for download")
+        compress_outputs(outputs.values())
+
         ctx.outputs = outputs
 
+# ----------------------------------------------------------------------------------------------------------------------
+# step scheduler
+# ----------------------------------------------------------------------------------------------------------------------
+
+def step_dependencies(steps: Sequence[PipelineStep]) -> List[set]:
+    # a step waits for every earlier step whose writes it reads or overwrites, or which reads what it writes
+    dependencies = []
+    for i, step in enumerate(steps):
+        reads, writes = set(step.reads), set(step.writes)
+        dependencies.append({
+            j for j, earlier in enumerate(steps[:i])
+            if set(earlier.writes) & (reads | writes) or set(earlier.reads) & writes
+        })
+    return dependencies
+
+
+def checkpoint_dir(ctx: PipelineContext, idx: int, step: PipelineStep) -> Path:
+    return ctx.job_dir / CHECKPOINTS_DIR / f"{idx}-{step.__class__.__name__}"
+
+
+def restore_checkpoints(steps: Sequence[PipelineStep], ctx: PipelineContext) -> set:
+    # steps are restored in order up to the first one without a valid checkpoint, later ones are stale
+    restored = set()
+    for i, step in enumerate(steps):
+        values = load_checkpoint(checkpoint_dir(ctx, i + 1, step))
+        # checkpoints written before a step's fields were renamed lack some of its writes
+        if values is None or not set(step.writes) <= values.keys():
+            break
+        for name, value in values.items():
+            setattr(ctx, name, value)
+        restored.add(i)
+        logger.info(f"– restored checkpoint: {step.__class__.__name__}")
+    for i, step in enumerate(steps):
+        if i not in restored:
+            shutil.rmtree(checkpoint_dir(ctx, i + 1, step), ignore_errors=True)
+    return restored
+
+
+class FieldLifetimes:
+    # a context field is dropped once every step that reads or writes it has finished; with spilling,
+    # frames also wait in arrow files between their writer and their next reader instead of in memory
+    kept = ("outputs",)
+
+    def __init__(self, steps: Sequence[PipelineStep], ctx: PipelineContext, spill: bool = False):
+        self.steps = steps
+        self.ctx = ctx
+        self.spill = spill
+        self.users: Dict[str, set] = {}
+        for i, step in enumerate(steps):
+            for name in (*step.reads, *step.writes):
+                if name not in self.kept:
+                    self.users.setdefault(name, set()).add(i)
+        self.released = set()
+        self.spilled: Dict[str, Path] = {}
+
+    def acquire(self, i: int):
+        for name in self.steps[i].reads:
+            if name in self.spilled and getattr(self.ctx, name) is None:
+                setattr(self.ctx, name, load_frame(self.spilled[name]))
+
+    def release(self, i: int, finished: set, running: Sequence[int]):
+        # spilled values the step overwrote are stale, restored steps leave the spilled value in place
+        for name in self.steps[i].writes:
+            if name in self.spilled and getattr(self.ctx, name) is not None:
+                self.spilled.pop(name).unlink(missing_ok=True)
+
+        dropped = []
+        for name, users in self.users.items():
+            if name not in self.released and users <= finished:
+                self.released.add(name)
+                if getattr(self.ctx, name) is not None:
+                    dropped.append(name)
+                setattr(self.ctx, name, None)
+                if name in self.spilled:
+                    self.spilled.pop(name).unlink(missing_ok=True)
+
+        spilled = []
+        if self.spill:
+            needed = {name for j in running for name in self.steps[j].reads}
+            for name in dict.fromkeys((*self.steps[i].writes, *self.steps[i].reads)):
+                value = getattr(self.ctx, name)
+                if name in self.released or name in needed or value is None:
+                    continue
+                if name not in self.spilled and spillable(value):
+                    path = spill_frame(value, self.ctx.job_dir / SPILL_DIR / f"{name}.arrow")
+                    if path is not None:
+                        self.spilled[name] = path
+                if name in self.spilled:
+                    setattr(self.ctx, name, None)
+                    spilled.append(name)
+
+        if dropped:
+            logger.info(f"– released: {', '.join(dropped)}")
+        if spilled:
+            logger.info(f"– spilled: {', '.join(spilled)}")
+        if dropped or spilled:
+            gc.collect()
+
+    def close(self):
+        shutil.rmtree(self.ctx.job_dir / SPILL_DIR, ignore_errors=True)
+
+
+def run_steps(steps: Sequence[PipelineStep], ctx: PipelineContext, checkpoints: bool = False, resume: bool = False, spill: bool = False):
+    dependencies = step_dependencies(steps)
+    total = len(steps)
+    finished = restore_checkpoints(steps, ctx) if resume else set()
+    pending = set(range(total)) - finished
+    running = {}
+    error = None
+
+    lifetimes = FieldLifetimes(steps, ctx, spill=spill)
+    for i in sorted(finished):
+        lifetimes.release(i, finished, ())
+
+    if checkpoints and not resume:
+        shutil.rmtree(ctx.job_dir / CHECKPOINTS_DIR, ignore_errors=True)
+
+    def run_step(i):
+        steps[i](ctx, idx=i + 1, total=total)
+        # the scheduler holds back later writers of these fields until the checkpoint is written
+        if checkpoints:
+            save_checkpoint(checkpoint_dir(ctx, i + 1, steps[i]), {name: getattr(ctx, name) for name in steps[i].writes})
+
+    # steps share a child token, a failing step stops the concurrent ones without cancelling the job
+    cancel_token = ctx.cancel_token
+    ctx.cancel_token = CancelToken(parent=cancel_token)
+
+    def update_step():
+        ctx.step = f"{','.join(str(i + 1) for i in sorted(running.values()))}/{total}"
+        if ctx.progress_callback:
+            ctx.progress_callback(ctx.step)
+
+    try:
+        with ThreadPoolExecutor(max_workers=total) as executor:
+            while pending or running:
+                if error is None:
+                    for i in sorted(pending):
+                        if dependencies[i] <= finished:
+                            pending.remove(i)
+                            lifetimes.acquire(i)
+                            running[executor.submit(run_step, i)] = i
+                    update_step()
+                elif not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = running.pop(future)
+                    try:
+                        future.result()
+                        finished.add(i)
+                        lifetimes.release(i, finished, list(running.values()))
+                    except BaseException as e:
+                        if error is None:
+                            error = e
+                            ctx.cancel_token.cancel()
+    finally:
+        ctx.cancel_token = cancel_token
+        lifetimes.close()
+
+    if error is not None:
+        raise error
+
 # ----------------------------------------------------------------------------------------------------------------------
 # main orchestrator
 # ----------------------------------------------------------------------------------------------------------------------
@@ -272,15 +721,61 @@ def run_pipeline(
 
         netascore_gpkg: Optional[Path] = None,
         output_format: str = "GeoJSON",
+        layers: Optional[List[str]] = None,
         seed: Optional[int] = None,
+        streaming: bool = False,
+        flow_aggregation: str = "overall",
+        coordinate_precision: Optional[int] = None,
+        downcast_floats: bool = False,
+        feature_store: bool = True,
+        tile_seed_max_zoom: Optional[int] = None,
+        checkpoints: bool = False,
+        resume: bool = False,
+        base_job_dir: Optional[Path] = None,
+        time_budgets: Optional[List[float]] = None,
+        index_thresholds: Optional[List[float]] = None,
+        replicates: int = 1,
+        profile: bool = False,
+        trace_parent: Optional[str] = None,
+        spill: bool = False,
 
         job_dir: Optional[Path] = None,
 
-        progress_callback=None
+        progress_callback=None,
+        cancel_token: Optional[CancelToken] = None
 ) -> Dict[str, Path]:
-    if output_format not in {"GeoJSON", "GPKG"}:
+    if output_format not in OUTPUT_FORMATS:
         raise ValueError(f"Unsupported output format: {output_format}")
 
+    layers = layers or DEFAULT_LAYERS
+    if time_budgets or index_thresholds:
+        layers = [*layers, "stops_sweep"]
+    unknown_layers = set(layers) - set(LAYERS)
+    if unknown_layers:
+        raise ValueError(f"Unsupported layers: {', '.join(sorted(unknown_layers))}")
+    layers = [layer for layer in LAYERS if layer in layers]
+
+    if flow_aggregation not in FLOW_AGGREGATIONS:
+        raise ValueError(f"Unsupported flow aggregation: {flow_aggregation}")
+
+    if coordinate_precision is not None and not 0 <= coordinate_precision <= 15:
+        raise ValueError(f"Unsupported coordinate precision: {coordinate_precision}")
+
+    if tile_seed_max_zoom is not None and not 0 <= tile_seed_max_zoom <= MAX_ZOOM:
+        raise ValueError(f"Unsupported tile seed zoom: {tile_seed_max_zoom}")
+
+    if replicates < 1:
+        raise ValueError(f"Unsupported number of replicates: {replicates}")
+
+    time_budgets = sorted(set(time_budgets or [DISTANCE_TIME_BUDGET]))
+    index_thresholds = sorted(set(index_thresholds or [INDEX_THRESHOLD]))
+    # clusters, network and household trips are clipped to the distance of DISTANCE_TIME_BUDGET,
+    # longer budgets would count households of a smaller area
+    if not all(0 < budget <= DISTANCE_TIME_BUDGET for budget in time_budgets):
+        raise ValueError(f"Unsupported time budgets: {time_budgets}, allowed: up to {DISTANCE_TIME_BUDGET} min")
+    if not all(0 <= threshold <= 1 for threshold in index_thresholds):
+        raise ValueError(f"Unsupported index thresholds: {index_thresholds}")
+
     if job_dir is None:
         job_id = str(uuid.uuid4())
         job_dir = JOBS_DIR / job_id
@@ -297,7 +792,16 @@ def run_pipeline(
         job_dir=job_dir,
         netascore_gpkg=netascore_gpkg,
         output_format=output_format,
-        seed=seed
+        layers=layers,
+        seed=seed,
+        streaming=streaming,
+        flow_aggregation=flow_aggregation,
+        coordinate_precision=coordinate_precision,
+        downcast_floats=downcast_floats,
+        feature_store=feature_store,
+        tile_seed_max_zoom=tile_seed_max_zoom,
+        progress_callback=progress_callback,
+        cancel_token=cancel_token
     )
 
     fields = (
@@ -314,12 +818,39 @@ def run_pipeline(
         SnapPointsStep(),
         FilterNetworkStep(),
         EvaluateStopsStep(stops_id_field),
-        ExportResultsStep()
+        ExportResultsStep(layers)
     ]
-    for i, step in enumerate(steps, 1):
-        if progress_callback:
-            progress_callback(f"{i}/{len(steps)}")
-        step(ctx, idx=i, total=len(steps))
+
+    if "stops_sweep" in layers:
+        steps.insert(-2, SweepThresholdsStep(stops_id_field, time_budgets, index_thresholds))
+    if replicates > 1:
+        steps.insert(-1, ReplicatesStep(fields, replicates))
+
+    # derived jobs share the base job's checkpoints up to the network distances and only re-run the stop steps
+    if base_job_dir is not None:
+        steps = [*steps[:6], UpdateStopsStep(stops, stops_id_field), *steps[6:]]
+        for i, step in enumerate(steps[:6], 1):
+            src = find_checkpoint(base_job_dir, step.__class__.__name__)
+            if src is None:
+                raise ValueError(f"Base job has no checkpoint for {step.__class__.__name__}")
+            dst = checkpoint_dir(ctx, i, step)
+            if not dst.exists():
+                link_checkpoint(src, dst)
+        ctx.base_evaluation = find_checkpoint(base_job_dir, EvaluateStopsStep.__name__)
+        resume = True
+
+    # steps run in the scheduler's threads, their tracer attaches them to this span explicitly
+    tracer = Tracer.from_traceparent(job_dir / TRACES_FILE, trace_parent)
+    with tracer.span("run_pipeline", job_id=job_id, steps=len(steps), resume=resume) as span:
+        ctx.tracer = Tracer(tracer.path, tracer.trace_id, span.span_id)
+
+        # timings, memory and counters are always recorded, profile adds tracemalloc and stack sampling
+        with Profiler(job_dir, sampling=profile) as ctx.profiler:
+            run_steps(steps, ctx, checkpoints=checkpoints, resume=resume, spill=spill)
+
+    # kept checkpoints let failed jobs resume and derived jobs reuse this job's results
+    if not checkpoints:
+        shutil.rmtree(job_dir / CHECKPOINTS_DIR, ignore_errors=True)
 
     t1 = time.time()
     logger.info(f"■ job_id: {job_id} ({t1 - t0:.1f} s)")
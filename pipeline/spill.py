@@ -0,0 +1,42 @@
+import logging
+from pathlib import Path
+from typing import Any, Optional, Union
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+logger = logging.getLogger(__name__)
+
+SPILL_DIR = "spill"
+SPILL_MIN_ROWS = 100_000
+
+
+def spillable(value: Any) -> bool:
+    return isinstance(value, pd.DataFrame) and len(value) >= SPILL_MIN_ROWS
+
+
+def spill_frame(frame: Union[gpd.GeoDataFrame, pd.DataFrame], path: Path) -> Optional[Path]:
+    # uncompressed arrow ipc, read back through a memory map the file is paged in instead of parsed
+    path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        if isinstance(frame, gpd.GeoDataFrame):
+            frame.to_feather(path, compression="uncompressed")
+        else:
+            feather.write_feather(pa.Table.from_pandas(frame), path, compression="uncompressed")
+    except (pa.ArrowException, TypeError, ValueError) as e:
+        # mixed-type object columns have no arrow type, such frames stay in memory
+        logger.info(f"– not spilling {path.stem}: {e}")
+        path.unlink(missing_ok=True)
+        return None
+    return path
+
+
+def load_frame(path: Path) -> Union[gpd.GeoDataFrame, pd.DataFrame]:
+    # geo metadata marks the files written from a GeoDataFrame, the schema is read without the data
+    with pa.memory_map(str(path)) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    if b"geo" in metadata:
+        return gpd.read_feather(path, memory_map=True)
+    return feather.read_table(path, memory_map=True).to_pandas()
@@ -0,0 +1,54 @@
+import logging
+from typing import Any, Dict, List, Optional
+
+import geopandas as gpd
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+# context fields of the base job's EvaluateStopsStep that hold the per-stop rows of each layer
+LAYER_FIELDS = {
+    'stops_updated': ['stops_updated_gdf'],
+    'households': ['households_gdf'],
+    'stop_households': ['households_gdf'],
+    'routes_base': ['routes_base_gdf'],
+    'routes_quality': ['routes_quality_gdf'],
+    'edges_base': ['stop_edges_base_df'],
+    'edges_quality': ['stop_edges_quality_df'],
+    'edges': ['stop_edges_base_df', 'stop_edges_quality_df'],
+    'stop_edges': ['stop_edges_base_df', 'stop_edges_quality_df'],
+    'edge_flows_base': ['edge_flows_base_gdf'],
+    'edge_flows_quality': ['edge_flows_quality_gdf'],
+}
+
+
+def missing_base_fields(base: Dict[str, Any], layers: List[str]) -> List[str]:
+    # flows aggregated over all stops cannot be split up again, only per-stop flows are reusable
+    missing = []
+    for layer in layers:
+        for name in LAYER_FIELDS.get(layer, []):
+            value = base.get(name)
+            if value is None or 'stop_id' not in value.columns:
+                missing.append(name)
+    return sorted(set(missing))
+
+
+def unchanged_stop_ids(stops_gdf: gpd.GeoDataFrame, base_stops_gdf: gpd.GeoDataFrame, stops_id_field: str) -> set:
+    stops = stops_gdf[[stops_id_field, 'geometry']].rename(columns={stops_id_field: 'stop_id'})
+    merged = stops.merge(pd.DataFrame(base_stops_gdf[['stop_id', 'geometry']]), on='stop_id', suffixes=('', '_base'))
+    unchanged = merged[gpd.GeoSeries(merged['geometry']).geom_equals(gpd.GeoSeries(merged['geometry_base']))]
+    # stop ids occurring more than once are ambiguous and re-evaluated
+    return set(unchanged['stop_id']) - set(stops['stop_id'][stops['stop_id'].duplicated()])
+
+
+def combine_stop_rows(base_frame: Optional[pd.DataFrame], frame: Optional[pd.DataFrame], stop_ids: set) -> Optional[pd.DataFrame]:
+    if base_frame is None or frame is None:
+        return frame
+    copied = base_frame[base_frame['stop_id'].isin(stop_ids)]
+    return pd.concat([copied, frame], ignore_index=True)
+
+
+def order_stops(stops_gdf: gpd.GeoDataFrame, stop_ids: list) -> gpd.GeoDataFrame:
+    positions = {stop_id: i for i, stop_id in reversed(list(enumerate(stop_ids)))}
+    return stops_gdf.sort_values('stop_id', key=lambda s: s.map(positions), kind='stable').reset_index(drop=True)
@@ -7,6 +7,8 @@ import pandas as pd
 from geopandas import GeoDataFrame
 from shapely.geometry import Polygon, MultiPolygon, Point, LineString
 
+from pipeline.dtypes import compact_frame
+
 
 logger = logging.getLogger(__name__)
 
@@ -88,7 +90,7 @@ def distribute_points_in_raster(
 
     points_gdf = gpd.GeoDataFrame(output_records, crs=polygon_gdf.crs)
 
-    return points_gdf
+    return compact_frame(points_gdf, ids=["point_id"], categories=["cluster_id"])
 
 
 def disaggregate_table_to_edges(
@@ -103,8 +105,8 @@ def disaggregate_table_to_edges(
     rng = random.Random(seed) if seed is not None else random
 
     # build cluster pools and shuffle
-    pools_a: Dict = (od_points_a_gdf.groupby("cluster_id")["point_id"].apply(list).to_dict())  # {1: [101, 102], 2: [201]}
-    pools_b: Dict = (od_points_b_gdf.groupby("cluster_id")["point_id"].apply(list).to_dict())
+    pools_a: Dict = (od_points_a_gdf.groupby("cluster_id", observed=True)["point_id"].apply(list).to_dict())  # {1: [101, 102], 2: [201]}
+    pools_b: Dict = (od_points_b_gdf.groupby("cluster_id", observed=True)["point_id"].apply(list).to_dict())
 
     for pool in pools_a.values():
         rng.shuffle(pool)  # {1: [102, 101], 2: [201]}
@@ -152,7 +154,7 @@ def disaggregate_table_to_edges(
             for point_a_id, point_b_id in zip(points_a, points_b)
         )
 
-    edges_df = pd.DataFrame(edges)
+    edges_df = compact_frame(pd.DataFrame(edges), ids=["point_a_id", "point_b_id"], categories=[od_table_a_id_field, od_table_b_id_field])
     if edges_df.empty:
         return gpd.GeoDataFrame(edges_df, geometry=[], crs=od_points_a_gdf.crs)
 
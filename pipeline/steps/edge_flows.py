@@ -0,0 +1,84 @@
+import geopandas as gpd
+import networkx as nx
+
+
+FLOW_AGGREGATIONS = ["overall", "stop"]
+
+
+def directed_index(d, u, v, index_ft='index_bike_ft', index_tf='index_bike_tf'):
+    # reverse edges carry the attributes of the netascore edge, the direction decides which index applies
+    return d.get(index_ft) if (d.get('from_node'), d.get('to_node')) == (u, v) else d.get(index_tf)
+
+
+class EdgeFlowAccumulator:
+    # counts how many households' shortest paths to a stop traverse each directed edge, using the shortest-path tree
+    # of the dijkstra from the stop instead of materialising the individual paths
+    def __init__(self, G: nx.DiGraph, by_stop: bool = False):
+        self.G = G
+        self.by_stop = by_stop
+        self.flows = {}
+
+    def add(self, stop_id, paths, household_counts):
+        # paths come from the reversed graph and run from the stop to each node, households at a node travel to its parent
+        nodes = sorted(paths, key=lambda n: len(paths[n]))
+
+        index_sum = {}
+        index_length = {}
+        for n in nodes:
+            if len(paths[n]) < 2:
+                index_sum[n] = index_length[n] = 0.0
+                continue
+            parent = paths[n][-2]
+            d = self.G[n][parent]
+            index_value = directed_index(d, n, parent)
+            length = d.get('length', 0) if index_value is not None else 0
+            index_sum[n] = index_sum[parent] + (index_value or 0) * length
+            index_length[n] = index_length[parent] + length
+
+        households = dict(household_counts)
+        route_index_sum = {}
+        route_index_count = {}
+        for n, count in household_counts.items():
+            if n in index_length and index_length[n] > 0:
+                route_index_sum[n] = count * index_sum[n] / index_length[n]
+                route_index_count[n] = count
+
+        # leaves first, each node passes its subtree totals on to its parent
+        for n in reversed(nodes):
+            count = households.get(n, 0)
+            if not count or len(paths[n]) < 2:
+                continue
+            parent = paths[n][-2]
+            households[parent] = households.get(parent, 0) + count
+            route_index_sum[parent] = route_index_sum.get(parent, 0) + route_index_sum.get(n, 0)
+            route_index_count[parent] = route_index_count.get(parent, 0) + route_index_count.get(n, 0)
+
+            flow = self.flows.setdefault((stop_id if self.by_stop else None, n, parent), [0, 0.0, 0])
+            flow[0] += count
+            flow[1] += route_index_sum.get(n, 0)
+            flow[2] += route_index_count.get(n, 0)
+
+    def to_gdf(self, crs) -> gpd.GeoDataFrame:
+        records = []
+        for (stop_id, u, v), (households, route_index_sum, route_index_count) in self.flows.items():
+            d = self.G[u][v]
+            record = {'stop_id': stop_id} if self.by_stop else {}
+            record.update({
+                'osm_id': d.get('osm_id'),
+                'from_node': u,
+                'to_node': v,
+                'direction': 'ft' if (d.get('from_node'), d.get('to_node')) == (u, v) else 'tf',
+                'length': round(d.get('length', 0), 2),
+                'index': directed_index(d, u, v),
+                'households': households,
+                'household_length': round(households * d.get('length', 0), 2),
+                'route_index_average': round(route_index_sum / route_index_count, 2) if route_index_count else None,
+                'geometry': d.get('geometry'),
+            })
+            records.append(record)
+
+        columns = (['stop_id'] if self.by_stop else []) + [
+            'osm_id', 'from_node', 'to_node', 'direction', 'length', 'index',
+            'households', 'household_length', 'route_index_average', 'geometry',
+        ]
+        return gpd.GeoDataFrame(records, columns=columns, geometry='geometry', crs=crs)
@@ -4,18 +4,33 @@ import networkx as nx
 import pandas as pd
 from shapely.ops import linemerge
 
+from pipeline.cancellation import check_cancelled
+from pipeline.dtypes import compact_frame
+from pipeline.profiling import timed
+from pipeline.steps.normalize_results import link_households
+
 
 logger = logging.getLogger(__name__)
 
+STREAM_BATCH_SIZE = 10000
+# households have access over the quality network if their route there is at most this much longer
+ACCESS_LENGTH_RATIO = 1.5
+
+# household and route rows are the largest frames of a job, their ids and metrics are kept in compact dtypes
+ROW_IDS = ['household_id', 'from_node', 'to_node']
+HOUSEHOLD_METRICS = ['length_base', 'length_quality', 'length_ratio', 'index_base', 'index_quality']
+ROUTE_METRICS = ['length', 'index_average']
+
 
 def compute_path_geometry(G, path):
-    lines = []
-    for u, v in zip(path[:-1], path[1:]):
-        if G.has_edge(u, v):
-            lines.append(G[u][v]['geometry'])
-    if lines:
-        return linemerge(lines) if len(lines) > 1 else lines[0]
-    return None
+    with timed("path_geometry"):
+        lines = []
+        for u, v in zip(path[:-1], path[1:]):
+            if G.has_edge(u, v):
+                lines.append(G[u][v]['geometry'])
+        if lines:
+            return linemerge(lines) if len(lines) > 1 else lines[0]
+        return None
 
 
 def compute_path_index_average(G, path, index_ft='index_bike_ft', index_tf='index_bike_tf'):
@@ -62,7 +77,32 @@ def compute_edges_index_average(G, reachable_edges, index_ft='index_bike_ft', in
     return round(index_sum / length_sum, 2) if length_sum > 0 else None
 
 
-def evaluate_accessibility(edges_gdf, stops_gdf, households_gdf, stops_id_field, G_base, G_quality, G_base_reversed, G_quality_reversed, distance_threshold, generate_graphs=True, generate_routes=True):
+def households_frame(records, crs):
+    return compact_frame(gpd.GeoDataFrame(records, geometry='geometry', crs=crs), ids=ROW_IDS, metrics=HOUSEHOLD_METRICS)
+
+
+def routes_frame(records, crs):
+    return compact_frame(gpd.GeoDataFrame(records, geometry='geometry', crs=crs), ids=ROW_IDS, metrics=ROUTE_METRICS)
+
+
+def flush_records(records, sink, crs):
+    # records of layers without a sink are dropped, the layer was not requested
+    if sink is not None and records:
+        sink.write(routes_frame(records, crs))
+    records.clear()
+
+
+def flush_households(households, sinks, crs):
+    if households and {'households', 'stop_households'} & sinks.keys():
+        gdf = households_frame(households, crs)
+        if 'households' in sinks:
+            sinks['households'].write(gdf)
+        if 'stop_households' in sinks:
+            sinks['stop_households'].write(link_households(gdf))
+    households.clear()
+
+
+def evaluate_accessibility(edges_gdf, stops_gdf, households_gdf, stops_id_field, G_base, G_quality, G_base_reversed, G_quality_reversed, distance_threshold, generate_graphs=True, generate_routes=True, progress_callback=None, cancel_token=None, sinks=None, batch_size=STREAM_BATCH_SIZE, flows_base=None, flows_quality=None):
     households = []
     stops = []
     routes_base = []
@@ -70,12 +110,15 @@ def evaluate_accessibility(edges_gdf, stops_gdf, households_gdf, stops_id_field,
     edges_base = []
     edges_quality = []
 
-    for _, stop in stops_gdf.iterrows():
+    for i, (_, stop) in enumerate(stops_gdf.iterrows(), 1):
+        check_cancelled(cancel_token)
+
         stop_node_base = stop['node_id_base']
         stop_node_quality = stop['node_id_quality']
 
-        lengths_base, paths_base = nx.single_source_dijkstra(G_base_reversed, stop_node_base, cutoff=distance_threshold, weight='length')
-        lengths_quality, paths_quality = nx.single_source_dijkstra(G_quality_reversed, stop_node_quality, cutoff=distance_threshold, weight='length')
+        with timed("dijkstra", 2):
+            lengths_base, paths_base = nx.single_source_dijkstra(G_base_reversed, stop_node_base, cutoff=distance_threshold, weight='length')
+            lengths_quality, paths_quality = nx.single_source_dijkstra(G_quality_reversed, stop_node_quality, cutoff=distance_threshold, weight='length')
 
         households_in_proximity = households_gdf[households_gdf['node_id'].isin(lengths_base.keys())].copy()
 
@@ -109,14 +152,14 @@ def evaluate_accessibility(edges_gdf, stops_gdf, households_gdf, stops_id_field,
             path_index_average_base = None
             path_index_average_quality = None
 
-            if generate_routes:
-                path_base = paths_base.get(household_node)
-                path_quality = paths_quality.get(household_node)
+            path_base = paths_base.get(household_node)
+            path_quality = paths_quality.get(household_node)
 
-                if path_base:
-                    path_base = list(reversed(path_base))
+            if path_base:
+                path_base = list(reversed(path_base))
+                path_index_average_base = compute_path_index_average(G_base, path_base)
+                if generate_routes:
                     path_geom_base = compute_path_geometry(G_base, path_base)
-                    path_index_average_base = compute_path_index_average(G_base, path_base)
                     if path_geom_base:
                         base_routes.append({
                             'household_id': household['point_id'],
@@ -128,10 +171,11 @@ def evaluate_accessibility(edges_gdf, stops_gdf, households_gdf, stops_id_field,
                             'geometry': path_geom_base,
                         })
 
-                if path_quality:
-                    path_quality = list(reversed(path_quality))
+            if path_quality:
+                path_quality = list(reversed(path_quality))
+                path_index_average_quality  = compute_path_index_average(G_quality, path_quality)
+                if generate_routes:
                     path_geom_quality = compute_path_geometry(G_quality, path_quality)
-                    path_index_average_quality  = compute_path_index_average(G_quality, path_quality)
                     if path_geom_quality:
                         quality_routes.append({
                             'household_id': household['point_id'],
@@ -147,7 +191,7 @@ def evaluate_accessibility(edges_gdf, stops_gdf, households_gdf, stops_id_field,
             edges_length_ratio = None
             if length_base and length_quality:
                 edges_length_ratio = round(length_quality / length_base, 2)
-                if edges_length_ratio <= 1.5:
+                if edges_length_ratio <= ACCESS_LENGTH_RATIO:
                     access = True
                     households_quality += 1
 
@@ -169,6 +213,12 @@ def evaluate_accessibility(edges_gdf, stops_gdf, households_gdf, stops_id_field,
             routes_base.extend(base_routes)
             routes_quality.extend(quality_routes)
 
+        if flows_base is not None:
+            flows_base.add(stop[stops_id_field], paths_base, households_in_proximity['node_id'].value_counts().to_dict())
+        if flows_quality is not None:
+            nodes_quality = households_in_proximity['node_id'][households_in_proximity['node_id'].isin(lengths_quality.keys())]
+            flows_quality.add(stop[stops_id_field], paths_quality, nodes_quality.value_counts().to_dict())
+
         reachable_edges_base = {d['osm_id'] for u, v, d in G_base.edges(data=True) if u in lengths_base and v in lengths_base}
         reachable_edges_quality = {d['osm_id'] for u, v, d in G_quality.edges(data=True) if u in lengths_quality and v in lengths_quality}
 
@@ -200,15 +250,32 @@ def evaluate_accessibility(edges_gdf, stops_gdf, households_gdf, stops_id_field,
             'geometry': stop['geometry'],
         })
 
+        # streaming mode: households and routes are handed to the writers in batches instead of being kept until export
+        if sinks is not None and max(len(households), len(routes_base), len(routes_quality)) >= batch_size:
+            flush_households(households, sinks, edges_gdf.crs)
+            flush_records(routes_base, sinks.get('routes_base'), edges_gdf.crs)
+            flush_records(routes_quality, sinks.get('routes_quality'), edges_gdf.crs)
+
+        if progress_callback:
+            progress_callback(i, len(stops_gdf))
+
+    if sinks is not None:
+        flush_households(households, sinks, edges_gdf.crs)
+        flush_records(routes_base, sinks.get('routes_base'), edges_gdf.crs)
+        flush_records(routes_quality, sinks.get('routes_quality'), edges_gdf.crs)
+        households = routes_base = routes_quality = None
+
+    # stop-edge links, joined with the edge attributes only for the layers that need them
     if generate_graphs:
-        edges_base = edges_gdf.merge(pd.concat(edges_base).drop_duplicates(), on='osm_id')
-        edges_quality = edges_gdf.merge(pd.concat(edges_quality).drop_duplicates(), on='osm_id')
+        edges_base = pd.concat(edges_base).drop_duplicates()
+        edges_quality = pd.concat(edges_quality).drop_duplicates()
 
-    if generate_routes:
-        routes_base = gpd.GeoDataFrame(routes_base, geometry='geometry', crs=edges_gdf.crs)
-        routes_quality = gpd.GeoDataFrame(routes_quality, geometry='geometry', crs=edges_gdf.crs)
+    if generate_routes and sinks is None:
+        routes_base = routes_frame(routes_base, edges_gdf.crs)
+        routes_quality = routes_frame(routes_quality, edges_gdf.crs)
 
     stops = gpd.GeoDataFrame(stops, geometry='geometry', crs=edges_gdf.crs)
-    households = gpd.GeoDataFrame(households, geometry='geometry', crs=edges_gdf.crs)
+    if sinks is None:
+        households = households_frame(households, edges_gdf.crs)
 
     return edges_base, edges_quality, routes_base, routes_quality, stops, households
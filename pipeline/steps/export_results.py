@@ -0,0 +1,334 @@
+import gzip
+import json
+import logging
+import os
+import re
+import shutil
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+import shapely
+
+from pipeline.dtypes import restore_frame, shortest_floats
+from pipeline.profiling import timed
+
+
+logger = logging.getLogger(__name__)
+
+LAYERS = [
+    "od_points_a", "od_points_b", "od_edges",
+    "edges_base", "edges_quality",
+    "routes_base", "routes_quality",
+    "stops_updated", "households",
+    # normalized schema: every edge and household once, stops are linked to them by integer ids
+    "edges", "stop_edges", "household_points", "stop_households",
+    # households per directed edge, aggregated over the shortest-path trees of the stops
+    "edge_flows_base", "edge_flows_quality",
+    # stop metrics per time budget and index threshold
+    "stops_sweep",
+]
+DEFAULT_LAYERS = ["stops_updated", "households"]
+STREAMABLE_LAYERS = ["households", "routes_base", "routes_quality", "stop_households"]
+
+OUTPUT_FORMATS = {
+    "GeoJSON": ("geojson", "GeoJSON"),
+    "GPKG": ("gpkg", "GPKG"),
+    "GeoParquet": ("parquet", "Parquet"),
+    "FlatGeobuf": ("fgb", "FlatGeobuf"),
+}
+CONTAINER_DRIVERS = {"GPKG"}
+
+EXPORT_WORKERS = 4
+PARQUET_ROW_GROUP_SIZE = 64 * 1024
+GEOPARQUET_VERSION = "1.1.0"
+
+# GeoParquet and FlatGeobuf are served as-is, the former is compressed internally, the latter is read by range
+COMPRESSIBLE_SUFFIXES = {".geojson", ".gpkg"}
+SIDECAR_ENCODINGS = {"zstd": ".zst", "gzip": ".gz"}
+
+# queryable copy of the layers for formats that cannot be filtered in place, GPKG results are queried directly
+FEATURE_STORE = "features.gpkg"
+FEATURE_STORE_INDEXED_COLUMNS = ["stop_id"]
+
+# identifiers keep full precision when floats are downcast
+ID_COLUMN_PATTERN = re.compile(r"(^|_)(id|node)$")
+
+
+def reduce_precision(gdf: Union[gpd.GeoDataFrame, pd.DataFrame], coordinate_precision: Optional[int] = None, downcast_floats: bool = False) -> Union[gpd.GeoDataFrame, pd.DataFrame]:
+    # compact intermediate dtypes go back to the original values, downcast layers keep their float32 metrics
+    gdf = restore_frame(gdf, floats=not downcast_floats)
+    if downcast_floats:
+        columns = [column for column in gdf.columns if gdf[column].dtype == "float64" and not ID_COLUMN_PATTERN.search(str(column))]
+        gdf = gdf.astype({column: "float32" for column in columns})
+    if coordinate_precision is not None and isinstance(gdf, gpd.GeoDataFrame):
+        geometry = shapely.set_precision(gdf.geometry.array, 10.0 ** -coordinate_precision, mode="pointwise")
+        gdf = gdf.copy(deep=False)
+        gdf[gdf.geometry.name] = gpd.GeoSeries(geometry, index=gdf.index, crs=gdf.crs)
+    return gdf
+
+
+def write_layer(gdf: Union[gpd.GeoDataFrame, pd.DataFrame], path: Path, driver: str, layer: Optional[str] = None, coordinate_precision: Optional[int] = None, downcast_floats: bool = False) -> None:
+    gdf = reduce_precision(gdf, coordinate_precision, downcast_floats)
+    with timed("file_write"):
+        if not isinstance(gdf, gpd.GeoDataFrame):
+            write_table(gdf, path, driver, layer=layer)
+        elif driver == "Parquet":
+            # bbox covering columns let readers skip row groups outside their area of interest
+            gdf.to_parquet(path, compression="zstd", row_group_size=PARQUET_ROW_GROUP_SIZE, write_covering_bbox=True)
+        elif driver == "FlatGeobuf":
+            gdf.to_file(path, driver=driver, engine="pyogrio", use_arrow=True, layer_options={"SPATIAL_INDEX": "YES"})
+        else:
+            # the GeoJSON driver writes full doubles unless told otherwise
+            layer_options = {"COORDINATE_PRECISION": coordinate_precision} if driver == "GeoJSON" and coordinate_precision is not None else None
+            gdf.to_file(path, driver=driver, layer=layer, engine="pyogrio", use_arrow=True, layer_options=layer_options)
+
+
+def write_table(df: pd.DataFrame, path: Path, driver: str, layer: Optional[str] = None) -> None:
+    if driver == "Parquet":
+        df.to_parquet(path, compression="zstd", row_group_size=PARQUET_ROW_GROUP_SIZE, index=False)
+    else:
+        # link tables have no geometry, the FlatGeobuf spatial index does not accept empty geometries
+        layer_options = {"SPATIAL_INDEX": "NO"} if driver == "FlatGeobuf" else None
+        pyogrio.write_dataframe(df, path, driver=driver, layer=layer, use_arrow=True, layer_options=layer_options)
+
+
+def export_layers(frames: Dict[str, Union[gpd.GeoDataFrame, pd.DataFrame]], job_dir: Path, output_format: str, coordinate_precision: Optional[int] = None, downcast_floats: bool = False) -> Dict[str, Path]:
+    _, driver = OUTPUT_FORMATS[output_format]
+    paths = {layer: layer_path(job_dir, layer, output_format) for layer in frames}
+    options = {"coordinate_precision": coordinate_precision, "downcast_floats": downcast_floats}
+
+    # all layers go into one container, sqlite takes a single writer at a time
+    if driver in CONTAINER_DRIVERS:
+        for layer, gdf in frames.items():
+            write_layer(gdf, paths[layer], driver, layer=layer, **options)
+        return paths
+
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as executor:
+        futures = [executor.submit(write_layer, gdf, paths[layer], driver, **options) for layer, gdf in frames.items()]
+        for future in futures:
+            future.result()
+    return paths
+
+
+def layer_path(job_dir: Path, layer: str, output_format: str) -> Path:
+    extension, driver = OUTPUT_FORMATS[output_format]
+    return job_dir / (f"results.{extension}" if driver in CONTAINER_DRIVERS else f"{layer}.{extension}")
+
+# ----------------------------------------------------------------------------------------------------------------------
+# feature store
+# ----------------------------------------------------------------------------------------------------------------------
+
+def feature_store_path(job_dir: Path, output_format: str) -> Path:
+    return job_dir / "results.gpkg" if output_format == "GPKG" else job_dir / FEATURE_STORE
+
+
+def write_feature_store(frames: Dict[str, Union[gpd.GeoDataFrame, pd.DataFrame]], path: Path, coordinate_precision: Optional[int] = None, downcast_floats: bool = False) -> None:
+    # GDAL creates an R-tree for every spatial layer of a GPKG
+    for layer, gdf in frames.items():
+        write_layer(gdf, path, "GPKG", layer=layer, coordinate_precision=coordinate_precision, downcast_floats=downcast_floats)
+
+
+def index_feature_store(path: Path) -> None:
+    with sqlite3.connect(path) as con:
+        tables = [row[0] for row in con.execute("SELECT table_name FROM gpkg_contents WHERE data_type IN ('features', 'attributes')")]
+        for table in tables:
+            columns = {row[1] for row in con.execute(f'PRAGMA table_info("{table}")')}
+            for column in FEATURE_STORE_INDEXED_COLUMNS:
+                if column in columns:
+                    con.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{column}_idx" ON "{table}" ("{column}")')
+
+# ----------------------------------------------------------------------------------------------------------------------
+# streaming feature writers
+# ----------------------------------------------------------------------------------------------------------------------
+
+class FeatureWriter:
+    def __init__(self, path: Path, layer: str, crs, coordinate_precision: Optional[int] = None, downcast_floats: bool = False):
+        self.path = path
+        self.layer = layer
+        self.crs = crs
+        self.coordinate_precision = coordinate_precision
+        self.downcast_floats = downcast_floats
+        self.count = 0
+
+    def write(self, gdf: Union[gpd.GeoDataFrame, pd.DataFrame]) -> None:
+        if len(gdf):
+            # optional metrics can be missing for a whole batch, their type must not change between batches
+            empty = [column for column in gdf.columns if gdf[column].dtype == object and gdf[column].isna().all()]
+            gdf = gdf.astype({column: "float64" for column in empty})
+            with timed("file_write"):
+                self.write_batch(reduce_precision(gdf, self.coordinate_precision, self.downcast_floats))
+            self.count += len(gdf)
+
+    def close(self) -> None:
+        if self.count == 0:
+            self.write_batch(gpd.GeoDataFrame(geometry=[], crs=self.crs))
+        self.finish()
+
+    def abort(self) -> None:
+        self.finish()
+
+    def write_batch(self, gdf: Union[gpd.GeoDataFrame, pd.DataFrame]) -> None:
+        raise NotImplementedError()
+
+    def finish(self) -> None:
+        pass
+
+
+class GPKGFeatureWriter(FeatureWriter):
+    def write_batch(self, gdf):
+        pyogrio.write_dataframe(gdf, self.path, driver="GPKG", layer=self.layer, append=bool(self.count), use_arrow=True)
+
+
+class GeoJSONFeatureWriter(FeatureWriter):
+    def __init__(self, path, layer, crs, **options):
+        super().__init__(path, layer, crs, **options)
+        self.file = open(path, "w", encoding="utf-8")
+        self.file.write(f'{{"type": "FeatureCollection", "name": {json.dumps(layer)}, "features": [\n')
+
+    def write_batch(self, gdf):
+        if isinstance(gdf, gpd.GeoDataFrame):
+            geometries = shapely.to_geojson(gdf.geometry.values)
+            gdf = gdf.drop(columns=gdf.geometry.name)
+        else:
+            geometries = ["null"] * len(gdf)
+        # float32 values are written with their shortest representation instead of the widened double
+        float32_columns = [column for column in gdf.columns if gdf[column].dtype == "float32"]
+        gdf = gdf.assign(**{column: shortest_floats(gdf[column]) for column in float32_columns})
+        properties = gdf.to_json(orient="records", lines=True).splitlines()
+        features = (f'{{"type": "Feature", "properties": {props}, "geometry": {geom}}}' for props, geom in zip(properties, geometries))
+        self.file.write((",\n" if self.count else "") + ",\n".join(features))
+
+    def finish(self):
+        self.file.write("\n]}\n")
+        self.file.close()
+
+    def abort(self):
+        self.file.close()
+
+
+class GeoParquetFeatureWriter(FeatureWriter):
+    def __init__(self, path, layer, crs, **options):
+        super().__init__(path, layer, crs, **options)
+        self.writer: Optional[pq.ParquetWriter] = None
+        self.schema: Optional[pa.Schema] = None
+
+    def write_batch(self, gdf):
+        if isinstance(gdf, gpd.GeoDataFrame):
+            table = pa.table(gdf.to_arrow(index=False, geometry_encoding="WKB"))
+        else:
+            table = pa.Table.from_pandas(gdf, preserve_index=False)
+        if self.writer is None:
+            self.schema = self.streaming_schema(table.schema)
+            self.writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+        self.writer.write_table(table.select(self.schema.names).cast(self.schema), row_group_size=PARQUET_ROW_GROUP_SIZE)
+
+    def finish(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    @staticmethod
+    def streaming_schema(schema: pa.Schema) -> pa.Schema:
+        # geometry fields carry their crs as geoarrow metadata, the geo metadata built from them must hold for all batches
+        columns = {}
+        for field in schema:
+            if field.metadata and field.metadata.get(b"ARROW:extension:name") == b"geoarrow.wkb":
+                extension = json.loads(field.metadata.get(b"ARROW:extension:metadata") or b"{}")
+                columns[field.name] = {"encoding": "WKB", "crs": extension.get("crs"), "geometry_types": []}
+        if not columns:
+            return schema
+        geo = {"primary_column": next(iter(columns)), "columns": columns, "version": GEOPARQUET_VERSION}
+        return pa.schema(schema, metadata={**(schema.metadata or {}), b"geo": json.dumps(geo).encode("utf-8")})
+
+
+class FlatGeobufFeatureWriter(GeoParquetFeatureWriter):
+    # the packed spatial index needs all features, batches are spooled to parquet and converted as a stream
+    def __init__(self, path, layer, crs, **options):
+        self.target = path
+        super().__init__(path.with_name(f".spool-{path.stem}.parquet"), layer, crs, **options)
+
+    def finish(self):
+        super().finish()
+        parquet_file = pq.ParquetFile(self.path)
+        reader = pa.RecordBatchReader.from_batches(parquet_file.schema_arrow, parquet_file.iter_batches())
+        if b"geo" in (parquet_file.schema_arrow.metadata or {}):
+            pyogrio.write_arrow(
+                reader, self.target, driver="FlatGeobuf", geometry_name="geometry", geometry_type="Unknown",
+                crs=self.crs.to_wkt() if self.crs else None, layer_options={"SPATIAL_INDEX": "YES"}
+            )
+        else:
+            pyogrio.write_arrow(reader, self.target, driver="FlatGeobuf", layer_options={"SPATIAL_INDEX": "NO"})
+        self.path.unlink()
+        self.path = self.target
+
+    def abort(self):
+        super().finish()
+        self.path.unlink(missing_ok=True)
+
+
+class TeeFeatureWriter(FeatureWriter):
+    # writes the same batches to the output and the feature store
+    def __init__(self, *writers: FeatureWriter):
+        super().__init__(writers[0].path, writers[0].layer, writers[0].crs)
+        self.writers = writers
+
+    def write(self, gdf):
+        for writer in self.writers:
+            writer.write(gdf)
+        self.count += len(gdf)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+        self.path = self.writers[0].path
+
+    def abort(self):
+        for writer in self.writers:
+            writer.abort()
+
+
+FEATURE_WRITERS = {
+    "GeoJSON": GeoJSONFeatureWriter,
+    "GPKG": GPKGFeatureWriter,
+    "GeoParquet": GeoParquetFeatureWriter,
+    "FlatGeobuf": FlatGeobufFeatureWriter,
+}
+
+
+def open_feature_writers(layers: Iterable[str], job_dir: Path, output_format: str, crs, feature_store: bool = False, **options) -> Dict[str, FeatureWriter]:
+    writers = {layer: FEATURE_WRITERS[output_format](layer_path(job_dir, layer, output_format), layer, crs, **options) for layer in layers}
+    if feature_store and output_format != "GPKG":
+        store = feature_store_path(job_dir, output_format)
+        writers = {layer: TeeFeatureWriter(writer, GPKGFeatureWriter(store, layer, crs, **options)) for layer, writer in writers.items()}
+    return writers
+
+# ----------------------------------------------------------------------------------------------------------------------
+# download sidecars
+# ----------------------------------------------------------------------------------------------------------------------
+
+def write_sidecar(path: Path, encoding: str) -> Path:
+    sidecar = path.with_name(path.name + SIDECAR_ENCODINGS[encoding])
+    tmp_path = sidecar.with_name(f".tmp-{sidecar.name}")
+    with open(path, "rb") as src:
+        if encoding == "gzip":
+            with gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        else:
+            with pa.CompressedOutputStream(str(tmp_path), encoding) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp_path, sidecar)
+    return sidecar
+
+
+def compress_outputs(paths: Iterable[Path]) -> None:
+    paths = {path for path in paths if path.suffix.lower() in COMPRESSIBLE_SUFFIXES}
+    with ThreadPoolExecutor(max_workers=EXPORT_WORKERS) as executor:
+        futures = [executor.submit(write_sidecar, path, encoding) for path in paths for encoding in SIDECAR_ENCODINGS]
+        for future in futures:
+            future.result()
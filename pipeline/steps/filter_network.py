@@ -2,8 +2,12 @@ import geopandas as gpd
 import networkx as nx
 import pandas as pd
 
+from pipeline.cancellation import check_cancelled
+from pipeline.dtypes import compact_frame
+from pipeline.profiling import timed
 
-def add_network_distance(od_edges_gdf, od_points_a_gdf, od_points_b_gdf, G_base) -> gpd.GeoDataFrame:
+
+def add_network_distance(od_edges_gdf, od_points_a_gdf, od_points_b_gdf, G_base, progress_callback=None, cancel_token=None) -> gpd.GeoDataFrame:
     points_a = od_points_a_gdf.set_index('point_id')['node_id'].to_dict()
     points_b = od_points_b_gdf.set_index('point_id')['node_id'].to_dict()
 
@@ -12,11 +16,22 @@ def add_network_distance(od_edges_gdf, od_points_a_gdf, od_points_b_gdf, G_base)
         node_b_id = points_b.get(row.point_b_id)
         if pd.notnull(node_a_id) and pd.notnull(node_b_id):
             try:
-                return round(nx.shortest_path_length(G_base, source=node_a_id, target=node_b_id, weight='length'), 2)
+                with timed("shortest_path"):
+                    return round(nx.shortest_path_length(G_base, source=node_a_id, target=node_b_id, weight='length'), 2)
             except (nx.NetworkXNoPath, nx.NodeNotFound):
                 return None
         return None
 
-    od_edges_gdf['distance'] = [get_network_distance(row) for row in od_edges_gdf.itertuples(index=False)]
+    total = len(od_edges_gdf)
+    report_every = max(total // 100, 1)
+
+    distances = []
+    for i, row in enumerate(od_edges_gdf.itertuples(index=False), 1):
+        check_cancelled(cancel_token)
+        distances.append(get_network_distance(row))
+        if progress_callback and (i % report_every == 0 or i == total):
+            progress_callback(i, total)
+
+    od_edges_gdf['distance'] = distances
 
-    return od_edges_gdf
+    return compact_frame(od_edges_gdf, metrics=['distance'])
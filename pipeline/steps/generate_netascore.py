@@ -1,9 +1,20 @@
+import os
+import re
 import subprocess
+import sys
+import threading
+import time
 from pathlib import Path
+from typing import IO, Optional
 
 import yaml
 
 from api.config import settings
+from api.metrics import NETASCORE_DURATION
+from pipeline.cancellation import CancelToken, PipelineCancelled
+from pipeline.tracing import Tracer
+
+NETASCORE_PHASE_PATTERN = re.compile(r"=== (.+?) ===")
 
 
 def update_settings(settings_input_path: Path, settings_output_path: Path, target_srid: int, bbox_str: str, case_id: str = "default_case") -> None:
@@ -33,6 +44,50 @@ def update_settings(settings_input_path: Path, settings_output_path: Path, targe
         yaml.safe_dump(netascore_settings, f, sort_keys=False, allow_unicode=True)
 
 
-def run_netascore(netascore_dir: Path, netascore_settings: Path) -> None:
+def trace_phases(stream: IO[str], tracer: Optional[Tracer], parent_id: Optional[str]) -> None:
+    # netascore does not trace itself, its phase banners on stdout open and close one span per phase
+    span = None
+    for line in stream:
+        sys.stdout.write(line)
+        match = NETASCORE_PHASE_PATTERN.search(line)
+        if match and tracer is not None:
+            if span is not None:
+                span.end()
+            span = tracer.start_span(f"netascore {match.group(1)}", parent_id=parent_id)
+    if span is not None:
+        span.end()
+
+
+def run_netascore(netascore_dir: Path, netascore_settings: Path, cancel_token: Optional[CancelToken] = None, tracer: Optional[Tracer] = None) -> None:
     cmd = ["python", "generate_index.py", str(netascore_settings)]
-    subprocess.run(cmd, cwd=netascore_dir, check=True)
+    # unbuffered so that phase banners arrive when they are printed
+    env = {**os.environ, "PYTHONUNBUFFERED": "1"}
+    parent_id = tracer.current_span_id() if tracer is not None else None
+
+    process = subprocess.Popen(cmd, cwd=netascore_dir, env=env, stdout=subprocess.PIPE, text=True, errors="replace")
+    reader = threading.Thread(target=trace_phases, args=(process.stdout, tracer, parent_id), daemon=True)
+    reader.start()
+    t0 = time.monotonic()
+    try:
+        while True:
+            try:
+                process.wait(timeout=1)
+                break
+            except subprocess.TimeoutExpired:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+    except PipelineCancelled:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        reader.join(timeout=10)
+        NETASCORE_DURATION.observe(time.monotonic() - t0, status="cancelled")
+        raise
+
+    reader.join(timeout=10)
+    NETASCORE_DURATION.observe(time.monotonic() - t0, status="done" if process.returncode == 0 else "failed")
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
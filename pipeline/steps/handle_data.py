@@ -1,4 +1,14 @@
+import logging
+import os
+import uuid
+from pathlib import Path
+from typing import Optional
+
 import geopandas as gpd
+import pyarrow as pa
+
+
+logger = logging.getLogger(__name__)
 
 
 def calculate_distance(speed_kmh, time_minutes) -> int:
@@ -7,6 +17,30 @@ def calculate_distance(speed_kmh, time_minutes) -> int:
     return int(round(distance_meters))
 
 
+def read_gdf(path: Path, layer: Optional[str] = None, cache: bool = False) -> gpd.GeoDataFrame:
+    # parsed forms cached by the dataset registry sit next to the input, e.g. netascore.edge.parquet
+    cached = path.with_name(f"{path.stem}.{layer}.parquet" if layer else f"{path.stem}.parquet")
+    if cached != path and cached.exists():
+        return gpd.read_parquet(cached)
+    if path.suffix.lower() == ".parquet":
+        return gpd.read_parquet(path)
+    gdf = gpd.read_file(path, layer=layer)
+    # the frame is written as it was read, the dataset registry picks the file up for later jobs
+    if cache:
+        write_parquet_atomic(gdf, cached)
+    return gdf
+
+
+def write_parquet_atomic(gdf: gpd.GeoDataFrame, path: Path) -> None:
+    tmp_path = path.with_name(f".tmp-{uuid.uuid4()}.parquet")
+    try:
+        gdf.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except (pa.ArrowException, OSError, TypeError, ValueError) as e:
+        tmp_path.unlink(missing_ok=True)
+        logger.warning(f"– caching parsed form {path.name} failed: {e}")
+
+
 def ensure_wgs84(gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     if gdf.crs is None:
         return gdf.set_crs(4326)  # type: ignore[return-value]
@@ -0,0 +1,39 @@
+import logging
+from typing import Tuple
+
+import geopandas as gpd
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+STOP_HOUSEHOLD_COLUMNS = [
+    'stop_id', 'household_id',
+    'length_base', 'length_quality', 'length_ratio',
+    'index_base', 'index_quality', 'access',
+]
+
+
+def normalize_edges(edges_gdf: gpd.GeoDataFrame, stop_edges_base: pd.DataFrame, stop_edges_quality: pd.DataFrame) -> Tuple[gpd.GeoDataFrame, pd.DataFrame]:
+    links = stop_edges_base.merge(stop_edges_quality, on=['stop_id', 'osm_id'], how='outer', indicator=True)
+    links['base'] = links['_merge'] != 'right_only'
+    links['quality'] = links['_merge'] != 'left_only'
+
+    # edge ids are row positions in the network, several edges can share one osm_id
+    edges = edges_gdf.reset_index(drop=True)
+    edges.insert(0, 'edge_id', edges.index)
+    edges = edges[edges['osm_id'].isin(links['osm_id'])].reset_index(drop=True)
+
+    stop_edges = links.merge(edges[['edge_id', 'osm_id']], on='osm_id')[['stop_id', 'edge_id', 'base', 'quality']]
+    stop_edges = stop_edges.sort_values(['stop_id', 'edge_id'], kind='stable').reset_index(drop=True)
+
+    logger.info(f"– {len(edges)} edges, {len(stop_edges)} stop-edge links")
+    return edges, stop_edges
+
+
+def household_points(od_points_a_gdf: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
+    return od_points_a_gdf[['point_id', 'node_id', 'geometry']].rename(columns={'point_id': 'household_id'}).reset_index(drop=True)
+
+
+def link_households(households_gdf: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame(households_gdf[STOP_HOUSEHOLD_COLUMNS]).reset_index(drop=True)
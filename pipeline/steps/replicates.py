@@ -0,0 +1,145 @@
+import logging
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import List, Optional
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy.sparse.csgraph import dijkstra
+
+from pipeline.cancellation import check_cancelled
+from pipeline.profiling import timed
+from pipeline.steps.disaggregate_data import distribute_points_in_raster, disaggregate_table_to_edges
+from pipeline.steps.filter_network import add_network_distance
+from pipeline.steps.snap_points import build_balltree, snap_with_balltree
+from pipeline.steps.sweep_thresholds import EdgeArrays, count_households, household_nodes
+
+
+logger = logging.getLogger(__name__)
+
+# every worker holds a copy of the routing graph
+MAX_REPLICATE_WORKERS = 4
+REPLICATE_PERCENTILES = [5, 50, 95]
+REPLICATE_COLUMNS = [
+    'households_ratio_mean', 'households_ratio_std',
+    *(f'households_ratio_p{p}' for p in REPLICATE_PERCENTILES),
+]
+
+# ----------------------------------------------------------------------------------------------------------------------
+# household draws
+# ----------------------------------------------------------------------------------------------------------------------
+
+_worker_state = {}
+
+
+def replicate_seeds(seed: Optional[int], count: int) -> List[Optional[int]]:
+    # independent streams, seed + r would repeat the main draws of the jobs with the following seeds
+    if seed is None:
+        return [None] * count
+    return [int(child.generate_state(1)[0]) for child in np.random.SeedSequence(seed).spawn(count)]
+
+
+def routing_graph(G: nx.DiGraph) -> nx.DiGraph:
+    # node coordinates and edge lengths are all a draw needs, the edge geometries stay in the pipeline process
+    R = nx.DiGraph()
+    R.add_nodes_from((n, {'x': d['x'], 'y': d['y']}) for n, d in G.nodes(data=True))
+    R.add_weighted_edges_from(((u, v, d['length']) for u, v, d in G.edges(data=True)), weight='length')
+    return R
+
+
+def init_worker(G_base, od_clusters_a_gdf, od_clusters_b_gdf, od_table_df, fields, distance_threshold):
+    # the main run has already logged the trip reductions of the same table
+    logging.getLogger('pipeline.steps.disaggregate_data').setLevel(logging.ERROR)
+    _worker_state.update(
+        G_base=G_base, balltree=build_balltree(G_base), od_clusters_a_gdf=od_clusters_a_gdf, od_clusters_b_gdf=od_clusters_b_gdf,
+        od_table_df=od_table_df, fields=fields, distance_threshold=distance_threshold,
+    )
+
+
+def draw_households(seed: Optional[int]) -> pd.Series:
+    # one replicate of DisaggregateDataStep, the point snapping and FilterNetworkStep, returns households per node
+    state = _worker_state
+    a_id, a_count, b_id, b_count, t_a_id, t_b_id, t_trips = state['fields']
+    balltree, node_ids = state['balltree']
+
+    od_points_a_gdf = distribute_points_in_raster(state['od_clusters_a_gdf'], a_id, a_count, seed)
+    od_points_b_gdf = distribute_points_in_raster(state['od_clusters_b_gdf'], b_id, b_count, seed)
+    od_edges_gdf = disaggregate_table_to_edges(od_points_a_gdf, od_points_b_gdf, state['od_table_df'], t_a_id, t_b_id, t_trips, seed)
+    if od_edges_gdf.empty:
+        return pd.Series(dtype=np.int64)
+
+    od_points_a_gdf = snap_with_balltree(od_points_a_gdf, balltree, node_ids)
+    od_points_b_gdf = snap_with_balltree(od_points_b_gdf, balltree, node_ids)
+    od_edges_gdf = add_network_distance(od_edges_gdf, od_points_a_gdf, od_points_b_gdf, state['G_base'])
+
+    valid_a_ids = od_edges_gdf.loc[od_edges_gdf['distance'] <= state['distance_threshold'], 'point_a_id'].unique()
+    return od_points_a_gdf.loc[od_points_a_gdf['point_id'].isin(valid_a_ids), 'node_id']
+
+
+def draw_replicates(seeds: List[Optional[int]], G_base, od_clusters_a_gdf, od_clusters_b_gdf, od_table_df, fields, distance_threshold, progress_callback=None, cancel_token=None) -> List[pd.Series]:
+    # spawned workers receive the graph once, a forked worker would inherit the locks of the pipeline threads
+    max_workers = max(min(len(seeds), os.cpu_count() or 1, MAX_REPLICATE_WORKERS), 1)
+    initargs = (routing_graph(G_base), od_clusters_a_gdf, od_clusters_b_gdf, od_table_df, fields, distance_threshold)
+    results = {}
+    pending = set()
+
+    executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker, initargs=initargs)
+    try:
+        futures = {executor.submit(draw_households, seed): i for i, seed in enumerate(seeds)}
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=1.0, return_when=FIRST_COMPLETED)
+            check_cancelled(cancel_token)
+            for future in done:
+                results[futures[future]] = future.result()
+            if progress_callback and done:
+                progress_callback(len(results), len(seeds))
+    finally:
+        # on cancellation, running draws finish in the background instead of blocking the job
+        executor.shutdown(wait=not pending, cancel_futures=True)
+
+    return [results[i] for i in range(len(seeds))]
+
+# ----------------------------------------------------------------------------------------------------------------------
+# statistics
+# ----------------------------------------------------------------------------------------------------------------------
+
+def replicate_ratios(stops_gdf: gpd.GeoDataFrame, replicates: List[pd.Series], G_base: nx.DiGraph, distance_threshold: float, index_threshold: float, cancel_token=None) -> np.ndarray:
+    # the stop searches do not depend on the household draw, each runs once and serves every replicate
+    edges = EdgeArrays(G_base)
+    base_matrix = edges.reversed_matrix(np.ones(len(edges.u), dtype=bool))
+    quality_mask = edges.index >= index_threshold
+    quality_matrix = edges.reversed_matrix(quality_mask)
+
+    stop_points = np.array([[geom.x, geom.y] for geom in stops_gdf.geometry])
+    stop_nodes_quality = edges.snap(stop_points, quality_mask) if quality_mask.any() else None
+    draws = [household_nodes(pd.DataFrame({'node_id': nodes}), edges) for nodes in replicates]
+
+    ratios = np.zeros((len(stops_gdf), len(replicates)))
+    for i, stop_node in enumerate(stops_gdf['node_id'].map(edges.node_index)):
+        check_cancelled(cancel_token)
+        with timed("dijkstra"):
+            distances_base = dijkstra(base_matrix, indices=stop_node, limit=distance_threshold)
+        if stop_nodes_quality is None:
+            distances_quality = np.full(len(edges.nodes), np.inf)
+        else:
+            with timed("dijkstra"):
+                distances_quality = dijkstra(quality_matrix, indices=stop_nodes_quality[i], limit=distance_threshold)
+
+        for r, (nodes, counts) in enumerate(draws):
+            households_base, households_quality = count_households(distances_base, distances_quality, nodes, counts, stop_node, distance_threshold)
+            ratios[i, r] = round(households_quality / households_base, 2) if households_base > 0 else 0
+    return ratios
+
+
+def summarize_ratios(ratios: np.ndarray) -> pd.DataFrame:
+    stats = {
+        'households_ratio_mean': ratios.mean(axis=1),
+        'households_ratio_std': ratios.std(axis=1, ddof=1) if ratios.shape[1] > 1 else np.zeros(len(ratios)),
+    }
+    for p, values in zip(REPLICATE_PERCENTILES, np.percentile(ratios, REPLICATE_PERCENTILES, axis=1)):
+        stats[f'households_ratio_p{p}'] = values
+    return pd.DataFrame(stats, columns=REPLICATE_COLUMNS).round(4)
@@ -3,6 +3,8 @@ import numpy as np
 from geopandas import GeoDataFrame
 from sklearn.neighbors import BallTree
 
+from pipeline.dtypes import compact_frame
+
 
 def build_balltree(G: nx.DiGraph) -> tuple[BallTree, list]:
     node_coords = np.array([(data['x'], data['y']) for n, data in G.nodes(data=True)])
@@ -14,4 +16,4 @@ def snap_with_balltree(gdf: GeoDataFrame, balltree: BallTree, node_ids: list, no
     points_array = np.array([[geom.x, geom.y] for geom in gdf.geometry])
     _, indices = balltree.query(points_array, k=1)
     gdf[node_id_field] = [node_ids[i[0]] for i in indices]
-    return gdf
+    return compact_frame(gdf, ids=[node_id_field])
@@ -0,0 +1,78 @@
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+SUMMARY_FILE = "summary.json"
+STOP_METRICS = [
+    "households_base", "households_quality", "households_ratio",
+    "length_base", "length_quality", "length_ratio",
+    "index_average_base", "index_average_quality",
+    "households_ratio_mean", "households_ratio_std",
+]
+PERCENTILES = [5, 25, 50, 75, 95]
+HISTOGRAM_BINS = 10
+
+
+def to_json_value(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    return round(value, 4) if isinstance(value, float) else value
+
+
+def summarize_metric(values: pd.Series) -> Dict[str, Any]:
+    values = pd.to_numeric(values, errors="coerce").dropna().to_numpy(dtype=float)
+    if len(values) == 0:
+        return {"count": 0}
+    counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+    return {
+        "count": len(values),
+        "mean": to_json_value(values.mean()),
+        "min": to_json_value(values.min()),
+        "max": to_json_value(values.max()),
+        "percentiles": {f"p{p}": to_json_value(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+        "histogram": {"edges": [to_json_value(e) for e in edges], "counts": counts.tolist()},
+    }
+
+
+def summarize_stops(stops_gdf: pd.DataFrame) -> Dict[str, Any]:
+    metrics = [metric for metric in STOP_METRICS if metric in stops_gdf.columns]
+    stops = [
+        {key: to_json_value(value) for key, value in record.items()}
+        for record in stops_gdf[["stop_id", *metrics]].to_dict("records")
+    ]
+    households_base = stops_gdf["households_base"].sum() if "households_base" in stops_gdf else 0
+    households_quality = stops_gdf["households_quality"].sum() if "households_quality" in stops_gdf else 0
+    return {
+        "stop_count": len(stops),
+        "households_base": to_json_value(households_base),
+        "households_quality": to_json_value(households_quality),
+        "households_ratio": to_json_value(households_quality / households_base) if households_base else None,
+        "distributions": {metric: summarize_metric(stops_gdf[metric]) for metric in metrics},
+        "stops": stops,
+    }
+
+
+def write_summary(summary: Dict[str, Any], path: Path) -> Path:
+    tmp_path = path.with_name(f".tmp-{path.name}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    return path
+
+
+def summary_to_arrow(summary: Dict[str, Any]) -> bytes:
+    # the per-stop table as an arrow ipc stream, job-wide values are kept in the schema metadata
+    table = pa.Table.from_pylist(summary["stops"])
+    metadata = {key: json.dumps(value) for key, value in summary.items() if key != "stops"}
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema.with_metadata(metadata)) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
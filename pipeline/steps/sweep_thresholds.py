@@ -0,0 +1,142 @@
+import logging
+from typing import List, Tuple
+
+import geopandas as gpd
+import networkx as nx
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from sklearn.neighbors import BallTree
+
+from pipeline.cancellation import check_cancelled
+from pipeline.profiling import timed
+from pipeline.steps.edge_flows import directed_index
+from pipeline.steps.evaluate_stops import ACCESS_LENGTH_RATIO
+from pipeline.steps.handle_data import calculate_distance
+
+
+logger = logging.getLogger(__name__)
+
+SPEED_KMH = 15
+SWEEP_COLUMNS = [
+    'stop_id', 'time_budget', 'index_threshold', 'distance',
+    'households_base', 'households_quality', 'households_ratio',
+    'length_base', 'length_quality', 'length_ratio',
+]
+
+
+class EdgeArrays:
+    # the base graph as flat arrays, quality networks are masks over the same edges
+    def __init__(self, G: nx.DiGraph):
+        self.nodes = list(G.nodes)
+        self.node_index = {n: i for i, n in enumerate(self.nodes)}
+        self.coords = np.array([(G.nodes[n]['x'], G.nodes[n]['y']) for n in self.nodes])
+
+        edges = list(G.edges(data=True))
+        self.u = np.array([self.node_index[u] for u, _, _ in edges], dtype=np.int64)
+        self.v = np.array([self.node_index[v] for _, v, _ in edges], dtype=np.int64)
+        self.length = np.array([d.get('length', 0) for _, _, d in edges], dtype=float)
+        self.index = np.array([directed_index(d, u, v) for u, v, d in edges], dtype=float)
+        self.osm_codes, osm_ids = pd.factorize(pd.Series([d.get('osm_id') for _, _, d in edges], dtype=object))
+        self.osm_count = len(osm_ids)
+
+    def reversed_matrix(self, mask: np.ndarray) -> csr_matrix:
+        # routes run from the households to the stop, the search runs from the stop over reversed edges;
+        # zero lengths would be dropped as missing edges by the sparse graph
+        n = len(self.nodes)
+        weights = np.maximum(self.length[mask], 1e-9)
+        return csr_matrix((weights, (self.v[mask], self.u[mask])), shape=(n, n))
+
+    def osm_lengths(self, mask: np.ndarray) -> np.ndarray:
+        return np.bincount(self.osm_codes[mask], weights=self.length[mask], minlength=self.osm_count)
+
+    def snap(self, points: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        nodes = np.unique(np.concatenate([self.u[mask], self.v[mask]]))
+        _, indices = BallTree(self.coords[nodes]).query(points, k=1)
+        return nodes[indices[:, 0]]
+
+
+def reachable_length(edges: EdgeArrays, distances: np.ndarray, mask: np.ndarray, osm_lengths: np.ndarray, cutoff: float) -> float:
+    # as in the stop evaluation: osm ids of the edges with both nodes in reach, summed over all their edges
+    reached = mask & (np.maximum(distances[edges.u], distances[edges.v]) <= cutoff)
+    return float(osm_lengths[np.unique(edges.osm_codes[reached])].sum())
+
+
+def count_households(distances_base: np.ndarray, distances_quality: np.ndarray, household_nodes: np.ndarray, household_counts: np.ndarray, stop_node: int, cutoff: float) -> Tuple[int, int]:
+    # the access rule of the stop evaluation applied to distance arrays, households at the stop node always have access
+    length_base = distances_base[household_nodes]
+    length_quality = distances_quality[household_nodes]
+    in_reach = length_base <= cutoff
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.round(length_quality / length_base, 2)
+    access = (household_nodes == stop_node) | (
+        in_reach & (length_base > 0) & (length_quality > 0) & (length_quality <= cutoff) & (ratio <= ACCESS_LENGTH_RATIO)
+    )
+    return int(household_counts[in_reach].sum()), int(household_counts[access].sum())
+
+
+def household_nodes(households_gdf: gpd.GeoDataFrame, edges: EdgeArrays) -> Tuple[np.ndarray, np.ndarray]:
+    counts = households_gdf['node_id'].map(edges.node_index).dropna().astype(np.int64).value_counts()
+    return counts.index.to_numpy(), counts.to_numpy()
+
+
+def sweep_stops(stops_gdf: gpd.GeoDataFrame, households_gdf: gpd.GeoDataFrame, stops_id_field: str, G_base: nx.DiGraph, time_budgets: List[float], index_thresholds: List[float], progress_callback=None, cancel_token=None) -> pd.DataFrame:
+    edges = EdgeArrays(G_base)
+    cutoffs = {budget: calculate_distance(SPEED_KMH, budget) for budget in time_budgets}
+    max_cutoff = max(cutoffs.values())
+
+    base_mask = np.ones(len(edges.u), dtype=bool)
+    base_matrix = edges.reversed_matrix(base_mask)
+    base_osm_lengths = edges.osm_lengths(base_mask)
+
+    # one quality network per threshold, with the stops snapped to its own nodes
+    stop_points = np.array([[geom.x, geom.y] for geom in stops_gdf.geometry])
+    quality = {}
+    for threshold in index_thresholds:
+        mask = edges.index >= threshold
+        quality[threshold] = (mask, edges.reversed_matrix(mask), edges.osm_lengths(mask), edges.snap(stop_points, mask) if mask.any() else None)
+
+    nodes, counts = household_nodes(households_gdf, edges)
+
+    records = []
+    for i, (_, stop) in enumerate(stops_gdf.iterrows(), 1):
+        check_cancelled(cancel_token)
+        stop_node = edges.node_index[stop['node_id_base']]
+
+        # a single search per network at the largest cutoff, every budget masks its distances
+        with timed("dijkstra"):
+            distances_base = dijkstra(base_matrix, indices=stop_node, limit=max_cutoff)
+        distances_quality = {}
+        for threshold, (mask, matrix, _, snapped) in quality.items():
+            if snapped is None:
+                distances_quality[threshold] = np.full(len(edges.nodes), np.inf)
+            else:
+                with timed("dijkstra"):
+                    distances_quality[threshold] = dijkstra(matrix, indices=snapped[i - 1], limit=max_cutoff)
+
+        for budget, cutoff in cutoffs.items():
+            length_base = reachable_length(edges, distances_base, base_mask, base_osm_lengths, cutoff)
+
+            for threshold, (mask, _, osm_lengths, _) in quality.items():
+                households_base, households_quality = count_households(distances_base, distances_quality[threshold], nodes, counts, stop_node, cutoff)
+                length_quality = reachable_length(edges, distances_quality[threshold], mask, osm_lengths, cutoff)
+
+                records.append({
+                    'stop_id': stop[stops_id_field],
+                    'time_budget': budget,
+                    'index_threshold': threshold,
+                    'distance': cutoff,
+                    'households_base': households_base,
+                    'households_quality': households_quality,
+                    'households_ratio': round(households_quality / households_base, 2) if households_base > 0 else 0,
+                    'length_base': round(length_base, 2),
+                    'length_quality': round(length_quality, 2),
+                    'length_ratio': round(length_quality / length_base, 2) if length_base > 0 else 0,
+                })
+
+        if progress_callback:
+            progress_callback(i, len(stops_gdf))
+
+    logger.info(f"– {len(records)} stop-threshold rows for {len(cutoffs)} time budgets and {len(quality)} index thresholds")
+    return pd.DataFrame(records, columns=SWEEP_COLUMNS)
@@ -0,0 +1,232 @@
+import math
+import struct
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Tuple
+
+import geopandas as gpd
+import numpy as np
+import pyogrio
+import shapely
+from pyproj import CRS, Transformer
+
+TILES_DIR = "tiles"
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+MAX_ZOOM = 22
+MAX_LATITUDE = 85.0511287798
+# tolerance in tile units, geometries are simplified to what is visible at the requested zoom
+SIMPLIFY_TOLERANCE = 1.0
+
+GEOM_TYPES = {"Point": 1, "LineString": 2, "Polygon": 3}
+
+# ----------------------------------------------------------------------------------------------------------------------
+# tile grid
+# ----------------------------------------------------------------------------------------------------------------------
+
+def tile_lon(x: float, z: int) -> float:
+    return x / 2 ** z * 360.0 - 180.0
+
+
+def tile_lat(y: float, z: int) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / 2 ** z))))
+
+
+def tile_bounds(z: int, x: int, y: int, buffer: float = 0.0) -> Tuple[float, float, float, float]:
+    # buffer as a fraction of the tile size, clamped to the mercator world
+    n = 2 ** z
+    return (
+        tile_lon(max(x - buffer, 0), z), tile_lat(min(y + 1 + buffer, n), z),
+        tile_lon(min(x + 1 + buffer, n), z), tile_lat(max(y - buffer, 0), z),
+    )
+
+
+def tiles_covering(bounds: Tuple[float, float, float, float], z: int) -> Iterator[Tuple[int, int]]:
+    west, south, east, north = bounds
+    n = 2 ** z
+
+    def tile_x(lon):
+        return min(max(int((lon + 180.0) / 360.0 * n), 0), n - 1)
+
+    def tile_y(lat):
+        lat = math.radians(min(max(lat, -MAX_LATITUDE), MAX_LATITUDE))
+        return min(max(int((1 - math.asinh(math.tan(lat)) / math.pi) / 2 * n), 0), n - 1)
+
+    for x in range(tile_x(west), tile_x(east) + 1):
+        for y in range(tile_y(north), tile_y(south) + 1):
+            yield x, y
+
+
+def to_tile_coords(geometries: np.ndarray, z: int, x: int, y: int) -> np.ndarray:
+    n = 2 ** z
+
+    def project(coords):
+        lon = coords[:, 0]
+        lat = np.radians(np.clip(coords[:, 1], -MAX_LATITUDE, MAX_LATITUDE))
+        tx = ((lon + 180.0) / 360.0 * n - x) * TILE_EXTENT
+        ty = ((1 - np.arcsinh(np.tan(lat)) / np.pi) / 2 * n - y) * TILE_EXTENT
+        return np.column_stack([tx, ty])
+
+    return shapely.transform(geometries, project)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# protobuf encoding
+# ----------------------------------------------------------------------------------------------------------------------
+
+def varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value: int) -> int:
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def field(number: int, payload: bytes) -> bytes:
+    return varint(number << 3 | 2) + varint(len(payload)) + payload
+
+
+def packed(number: int, values: Iterable[int]) -> bytes:
+    return field(number, b"".join(varint(value) for value in values))
+
+
+def encode_value(value) -> bytes:
+    if isinstance(value, (bool, np.bool_)):
+        return varint(7 << 3) + varint(int(value))
+    if isinstance(value, (int, np.integer)):
+        return varint(6 << 3) + varint(zigzag(int(value)))
+    if isinstance(value, (float, np.floating)):
+        return varint(3 << 3 | 1) + struct.pack("<d", float(value))
+    return field(1, str(value).encode("utf-8"))
+
+
+def encode_geometry(geometry) -> Tuple[Optional[int], list]:
+    commands = []
+    cursor = [0, 0]
+
+    def add_path(coords, close):
+        coords = np.asarray(coords, dtype=np.int64)
+        if close:
+            coords = coords[:-1]
+        # consecutive duplicates appear when vertices collapse onto the same tile unit
+        keep = np.ones(len(coords), dtype=bool)
+        keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+        coords = coords[keep]
+        if len(coords) < (3 if close else 2 if geom_type == 2 else 1):
+            return
+        for i, (px, py) in enumerate(coords):
+            if i == 0:
+                commands.append(1 | 1 << 3 if geom_type != 1 else 1 | len(coords) << 3)
+            elif i == 1 and geom_type != 1:
+                commands.append(2 | (len(coords) - 1) << 3)
+            commands.extend((zigzag(int(px - cursor[0])), zigzag(int(py - cursor[1]))))
+            cursor[0], cursor[1] = px, py
+        if close:
+            commands.append(7 | 1 << 3)
+
+    parts = shapely.get_parts(geometry)
+    geom_type = GEOM_TYPES.get(parts[0].geom_type) if len(parts) else None
+    if geom_type == 1:
+        add_path(shapely.get_coordinates(parts), close=False)
+    elif geom_type == 2:
+        for part in parts:
+            add_path(part.coords, close=False)
+    elif geom_type == 3:
+        for part in parts:
+            # exterior rings have a positive area in tile coordinates, interior rings a negative one
+            part = shapely.geometry.polygon.orient(part, sign=1.0)
+            add_path(part.exterior.coords, close=True)
+            for interior in part.interiors:
+                add_path(interior.coords, close=True)
+    return geom_type, commands
+
+
+def encode_layer(gdf: gpd.GeoDataFrame, name: str) -> bytes:
+    keys, values, features = {}, {}, []
+    properties = gdf.drop(columns=gdf.geometry.name).to_dict("records")
+
+    for fid, geometry, record in zip(gdf.index, gdf.geometry.values, properties):
+        geom_type, commands = encode_geometry(geometry)
+        if not commands:
+            continue
+        tags = []
+        for key, value in record.items():
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            encoded = encode_value(value)
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault(encoded, len(values)))
+        features.append(
+            varint(1 << 3) + varint(int(fid)) + packed(2, tags) + varint(3 << 3) + varint(geom_type) + packed(4, commands)
+        )
+
+    if not features:
+        return b""
+
+    layer = varint(15 << 3) + varint(2) + field(1, name.encode("utf-8"))
+    layer += b"".join(field(2, feature) for feature in features)
+    layer += b"".join(field(3, key.encode("utf-8")) for key in keys)
+    layer += b"".join(field(4, value) for value in values)
+    layer += varint(5 << 3) + varint(TILE_EXTENT)
+    return field(3, layer)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# rendering
+# ----------------------------------------------------------------------------------------------------------------------
+
+def read_tile_features(store: Path, layer: str, z: int, x: int, y: int, crs=None) -> gpd.GeoDataFrame:
+    bbox = tile_bounds(z, x, y, buffer=TILE_BUFFER / TILE_EXTENT)
+    crs = CRS.from_user_input(crs) if crs else None
+    reproject = crs is not None and not crs.equals("EPSG:4326", ignore_axis_order=True)
+    if reproject:
+        bbox = Transformer.from_crs("EPSG:4326", crs, always_xy=True).transform_bounds(*bbox)
+    # the bbox filter is answered from the R-tree of the store
+    gdf = pyogrio.read_dataframe(store, layer=layer, bbox=bbox, fid_as_index=True)
+    if reproject:
+        gdf = gdf.to_crs("EPSG:4326")
+    return gdf
+
+
+def render_tile(store: Path, layer: str, z: int, x: int, y: int, crs=None) -> bytes:
+    gdf = read_tile_features(store, layer, z, x, y, crs=crs)
+    if gdf.empty:
+        return b""
+
+    geometries = to_tile_coords(gdf.geometry.array, z, x, y)
+    geometries = shapely.simplify(geometries, SIMPLIFY_TOLERANCE, preserve_topology=False)
+    geometries = shapely.clip_by_rect(geometries, -TILE_BUFFER, -TILE_BUFFER, TILE_EXTENT + TILE_BUFFER, TILE_EXTENT + TILE_BUFFER)
+    geometries = shapely.set_precision(geometries, 1.0, mode="pointwise")
+
+    gdf = gdf.set_geometry(gpd.GeoSeries(geometries, index=gdf.index))
+    gdf = gdf[~gdf.geometry.is_empty & gdf.geometry.notna()]
+    return encode_layer(gdf, layer)
+
+
+def tile_path(tiles_dir: Path, layer: str, z: int, x: int, y: int) -> Path:
+    return tiles_dir / layer / str(z) / str(x) / f"{y}.mvt"
+
+
+def seed_tiles(store: Path, layers: Iterable[str], tiles_dir: Path, max_zoom: int) -> int:
+    count = 0
+    for layer in layers:
+        info = pyogrio.read_info(store, layer=layer, force_total_bounds=True)
+        if not info["geometry_name"] or info["features"] == 0:
+            continue
+        crs = CRS.from_user_input(info["crs"]) if info["crs"] else None
+        bounds = info["total_bounds"]
+        if crs is not None and not crs.equals("EPSG:4326", ignore_axis_order=True):
+            bounds = Transformer.from_crs(crs, "EPSG:4326", always_xy=True).transform_bounds(*bounds)
+
+        for z in range(max_zoom + 1):
+            for x, y in tiles_covering(bounds, z):
+                tile = render_tile(store, layer, z, x, y, crs=crs)
+                if not tile:
+                    continue
+                path = tile_path(tiles_dir, layer, z, x, y)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.write_bytes(tile)
+                count += 1
+    return count
@@ -0,0 +1,143 @@
+import json
+import logging
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+TRACES_FILE = "traces.jsonl"
+SERVICE_NAME = "citwin-api"
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# otlp span kinds and status codes
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_write_lock = threading.Lock()
+
+# ----------------------------------------------------------------------------------------------------------------------
+# context
+# ----------------------------------------------------------------------------------------------------------------------
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def format_traceparent(trace_id: str, span_id: str) -> str:
+    # w3c trace context, the same string goes into http headers and links the pipeline spans to the job's request
+    return f"00-{trace_id}-{span_id}-01"
+
+
+def parse_traceparent(traceparent: Optional[str]) -> Optional[Tuple[str, str]]:
+    match = TRACEPARENT_PATTERN.match(traceparent or "")
+    return (match.group(1), match.group(2)) if match else None
+
+
+def to_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+# ----------------------------------------------------------------------------------------------------------------------
+# spans
+# ----------------------------------------------------------------------------------------------------------------------
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, parent_id: Optional[str] = None, span_id: Optional[str] = None, start_ns: Optional[int] = None, kind: int = SPAN_KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None):
+        self.tracer = tracer
+        self.name = name
+        self.parent_id = parent_id
+        self.span_id = span_id or new_span_id()
+        self.start_ns = start_ns or time.time_ns()
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.error = None
+
+    @property
+    def traceparent(self) -> str:
+        return format_traceparent(self.tracer.trace_id, self.span_id)
+
+    def end(self, error: Optional[str] = None, end_ns: Optional[int] = None):
+        self.tracer.export(self, end_ns or time.time_ns(), error or self.error)
+
+    def to_otlp(self, end_ns: int, error: Optional[str]) -> Dict[str, Any]:
+        span = {
+            "traceId": self.tracer.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(end_ns),
+            "attributes": [to_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+            "status": {"code": STATUS_ERROR, "message": error} if error else {"code": STATUS_OK},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Tracer:
+    # spans of one job appended to a json lines file, each line an otlp/json export request with a single span
+    def __init__(self, path: Path, trace_id: Optional[str] = None, parent_id: Optional[str] = None, scope: str = "pipeline"):
+        self.path = path
+        self.trace_id = trace_id or new_trace_id()
+        self.parent_id = parent_id
+        self.scope = scope
+        self._local = threading.local()
+
+    @classmethod
+    def from_traceparent(cls, path: Path, traceparent: Optional[str], scope: str = "pipeline") -> "Tracer":
+        trace_id, parent_id = parse_traceparent(traceparent) or (None, None)
+        return cls(path, trace_id, parent_id, scope)
+
+    def current_span_id(self) -> Optional[str]:
+        # spans nest per thread, threads without an open span attach to the tracer's parent
+        stack = getattr(self._local, "stack", None)
+        return stack[-1].span_id if stack else self.parent_id
+
+    def start_span(self, name: str, parent_id: Optional[str] = None, **kwargs) -> Span:
+        return Span(self, name, parent_id=parent_id or self.current_span_id(), **kwargs)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = self.start_span(name, attributes=attributes)
+        stack = self._local.__dict__.setdefault("stack", [])
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = str(e) or e.__class__.__name__
+            raise
+        finally:
+            stack.pop()
+            span.end()
+
+    def export(self, span: Span, end_ns: int, error: Optional[str] = None):
+        record = {
+            "resourceSpans": [{
+                "resource": {"attributes": [to_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": self.scope}, "spans": [span.to_otlp(end_ns, error)]}],
+            }]
+        }
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        try:
+            with _write_lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            # spans of a deleted job have nowhere to go
+            logger.warning(f"– span {span.name} not exported: {e}")